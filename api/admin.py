@@ -8,4 +8,5 @@ admin.site.register(Tag)
 admin.site.register(Project)
 admin.site.register(Subtask)
 admin.site.register(Stats)
-admin.site.register(Mode)
\ No newline at end of file
+admin.site.register(Mode)
+admin.site.register(RevokedToken)
@@ -1,6 +1,316 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
 from rest_framework.authentication import CSRFCheck
 from django.conf import settings
+from django.core.signing import BadSignature
+from django.utils.crypto import constant_time_compare
+from .cache import LRUCache
+from .models import User
+from .revocation import revoked_tokens
+import time
+import jwt
+
+# Columns left out of the cached user, they are
+# loaded on access if a view ever needs them
+SNAPSHOT_EXCLUDE = ('password',)
+
+# User columns embedded in the tokens, enough
+# for the views using ClaimsAuthentication
+CLAIM_FIELDS = (
+  'current_task_id',
+  'current_mode_id',
+  'auto_start_pomos',
+  'auto_start_breaks',
+  'claims_version',
+)
+
+
+def token_cache_settings():
+  return {
+    'ENABLED': True,
+    'MAX_SIZE': 1024,
+    'TTL': 300,
+    **getattr(settings, 'AUTH_TOKEN_CACHE', {})
+  }
+
+
+def refresh_storage_settings():
+  return {
+    'MODE': 'session',
+    'COOKIE': 'refresh_token',
+    'COOKIE_PATH': '/api/',
+    'COOKIE_SALT': 'api.refresh_token',
+    **getattr(settings, 'REFRESH_TOKEN_STORAGE', {})
+  }
+
+
+class TokenCache:
+  """
+  Bounded in-process cache of verified access tokens
+
+  Entries are keyed by the token's jti and hold the validated
+  token plus a snapshot of the user's row, so a cached token
+  skips the signature check and the user query.
+  Entries live at most TTL seconds and never past the token's exp.
+  """
+  def __init__(self, max_size):
+    self.entries = LRUCache(max_size)
+
+  @property
+  def enabled(self):
+    return token_cache_settings()['ENABLED']
+
+  def get(self, raw_token):
+    """
+    Returns the cached (user, validated token) pair
+    for raw_token, or None on a miss
+    """
+    try:
+      claims = jwt.decode(raw_token, options={'verify_signature': False})
+    except jwt.InvalidTokenError:
+      return None
+
+    entry = self.entries.get(claims.get(settings.SIMPLE_JWT['JTI_CLAIM']))
+
+    # The jti alone is not trusted, the cached token
+    # has to be the exact one that was verified
+    if entry is None or not constant_time_compare(entry['raw_token'], raw_token):
+      return None
+
+    return user_from_snapshot(entry['user'], entry['db']), entry['token']
+
+  def set(self, raw_token, validated_token, user):
+    expires_at = min(
+      time.time() + token_cache_settings()['TTL'],
+      validated_token['exp'])
+
+    self.entries.set(validated_token[settings.SIMPLE_JWT['JTI_CLAIM']], {
+      'raw_token': raw_token,
+      'token': validated_token,
+      'user': snapshot_user(user),
+      'user_id': user.pk,
+      'db': user._state.db,
+    }, expires_at)
+
+  def invalidate_token(self, jti):
+    self.entries.delete(jti)
+
+  def invalidate_user(self, user_id):
+    """
+    Drops every cached token of the user
+    """
+    self.entries.delete_where(lambda entry: entry['user_id'] == user_id)
+
+  def clear(self):
+    self.entries.clear()
+
+
+def snapshot_user(user):
+  """
+  Returns the user's columns as a dict, without the
+  ones in SNAPSHOT_EXCLUDE
+  """
+  return {
+    field.attname: getattr(user, field.attname)
+    for field in user._meta.concrete_fields
+    if field.attname not in SNAPSHOT_EXCLUDE
+  }
+
+
+def user_from_snapshot(snapshot, db):
+  """
+  Builds a new user instance out of a snapshot without
+  touching the database, excluded columns are deferred
+  """
+  return User.from_db(db, list(snapshot), list(snapshot.values()))
+
+
+token_cache = TokenCache(token_cache_settings()['MAX_SIZE'])
+
+
+class ClaimsVersions:
+  """
+  Bounded in-process cache of the users' claims_version,
+  read from their row on a miss
+
+  Entries live at most the token cache's TTL, a write
+  handled by another process goes unnoticed that long.
+  Inactive users have no version, none of their tokens
+  passes for current
+  """
+  def __init__(self, max_size):
+    self.entries = LRUCache(max_size)
+
+  def get(self, user_id):
+    version = self.entries.get(user_id)
+    if version is None:
+      version = User.objects.filter(id=user_id, is_active=True).values_list(
+        'claims_version', flat=True).first()
+      if version is not None:
+        self.set(user_id, version)
+    return version
+
+  def set(self, user_id, version):
+    self.entries.set(user_id, version, time.time() + token_cache_settings()['TTL'])
+
+  def invalidate(self, user_id):
+    self.entries.delete(user_id)
+
+  def clear(self):
+    self.entries.clear()
+
+
+claims_versions = ClaimsVersions(token_cache_settings()['MAX_SIZE'])
+
+
+def add_claims(token, claims):
+  """
+  Embeds the user columns in CLAIM_FIELDS into the token
+  """
+  for claim in CLAIM_FIELDS:
+    token[claim] = claims[claim]
+  return token
+
+
+def user_claims(user):
+  """
+  Returns the claims of a user just read or written,
+  its version is the current one
+  """
+  # to_python, as views may have set the columns straight from the request data
+  claims = {
+    claim: user._meta.get_field(claim).to_python(getattr(user, claim))
+    for claim in CLAIM_FIELDS
+  }
+  if user.is_active:
+    claims_versions.set(user.pk, claims['claims_version'])
+  return claims
+
+
+def access_token_for(user):
+  """
+  Returns a new access token carrying the user's current claims
+  """
+  return add_claims(AccessToken.for_user(user), user_claims(user))
+
+
+def set_access_cookie(response, access_token):
+  response.set_cookie(
+    settings.SIMPLE_JWT['AUTH_COOKIE'],
+    str(access_token),
+    max_age=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'],
+    httponly=settings.SIMPLE_JWT['AUTH_COOKIE_HTTP_ONLY'],
+    samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE'],
+    secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE']
+  )
+
+
+def get_refresh_token(request):
+  """
+  Returns the refresh token of the request, or None if there is none
+
+  Raises TokenError if the refresh cookie's signature is not valid
+  """
+  storage = refresh_storage_settings()
+
+  if storage['MODE'] != 'cookie':
+    return request.session.get('refresh')
+
+  if storage['COOKIE'] not in request.COOKIES:
+    return None
+
+  try:
+    return request.get_signed_cookie(storage['COOKIE'], salt=storage['COOKIE_SALT'])
+  except BadSignature:
+    raise TokenError('Refresh token cookie has an invalid signature')
+
+
+def store_refresh_token(request, response, refresh_token):
+  """
+  Keeps the refresh token either in the user's session or,
+  without touching the session table, in a signed
+  HttpOnly cookie only sent to the API routes
+  """
+  storage = refresh_storage_settings()
+
+  if storage['MODE'] != 'cookie':
+    request.session['refresh'] = str(refresh_token)
+    return
+
+  response.set_signed_cookie(
+    storage['COOKIE'],
+    str(refresh_token),
+    salt=storage['COOKIE_SALT'],
+    max_age=settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'],
+    path=storage['COOKIE_PATH'],
+    httponly=True,
+    samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE'],
+    secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE']
+  )
+
+
+def clear_refresh_token(request, response):
+  storage = refresh_storage_settings()
+
+  if storage['MODE'] != 'cookie':
+    request.session = {}
+    response.delete_cookie(settings.SESSION_COOKIE_NAME)
+    return
+
+  response.delete_cookie(
+    storage['COOKIE'],
+    path=storage['COOKIE_PATH'],
+    samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE'])
+
+
+def revoke_tokens(request):
+  """
+  Revokes the access and refresh tokens of the request,
+  the ones no longer valid are skipped
+  """
+  raw_tokens = [
+    (AccessToken, request.COOKIES.get(settings.SIMPLE_JWT['AUTH_COOKIE'])),
+  ]
+
+  try:
+    raw_tokens.append((RefreshToken, get_refresh_token(request)))
+  except TokenError:
+    pass
+
+  for token_class, raw_token in raw_tokens:
+    if not raw_token:
+      continue
+
+    try:
+      token = token_class(raw_token)
+    except TokenError:
+      continue
+
+    revoked_tokens.revoke(token)
+    token_cache.invalidate_token(token[settings.SIMPLE_JWT['JTI_CLAIM']])
+
+
+def has_refresh_token(request):
+  """
+  Whether the request comes from a logged in client
+  """
+  storage = refresh_storage_settings()
+
+  if storage['MODE'] != 'cookie':
+    return bool(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+  return storage['COOKIE'] in request.COOKIES
+
+
+def refresh_access_cookie(response, user):
+  """
+  Sends a new access token to the client after a change
+  in the user's claims, so ClaimsAuthentication never sees
+  stale values
+  """
+  set_access_cookie(response, access_token_for(user))
+
 
 # Authenticates the user on each request
 class CustomAuthentication(JWTAuthentication):
@@ -11,10 +321,60 @@ class CustomAuthentication(JWTAuthentication):
       raw_token = request.COOKIES.get(settings.SIMPLE_JWT['AUTH_COOKIE']) or None
     else:
       raw_token = self.get_raw_token(header)
-    
+
     if raw_token is None:
       return None
-    
-    validated_token = self.get_validated_token(raw_token)
+
+    if isinstance(raw_token, bytes):
+      raw_token = raw_token.decode()
+
     CSRFCheck(request)
-    return self.get_user(validated_token), validated_token
\ No newline at end of file
+    return self.authenticate_token(raw_token)
+
+  def authenticate_token(self, raw_token):
+    if token_cache.enabled:
+      cached = token_cache.get(raw_token)
+      if cached is not None:
+        self.check_revoked(cached[1])
+        return cached
+
+    validated_token = self.get_validated_token(raw_token)
+    self.check_revoked(validated_token)
+    user = self.get_user(validated_token)
+
+    if token_cache.enabled and isinstance(user, User):
+      token_cache.set(raw_token, validated_token, user)
+
+    return user, validated_token
+
+
+  def check_revoked(self, validated_token):
+    if revoked_tokens.is_revoked(validated_token[settings.SIMPLE_JWT['JTI_CLAIM']]):
+      raise InvalidToken('Token has been revoked')
+
+
+# Opt-in per view, for views that only need the
+# user's id or one of the columns in CLAIM_FIELDS
+class ClaimsAuthentication(CustomAuthentication):
+  def get_user(self, validated_token):
+    """
+    Builds the user straight from the token's claims without
+    a database read, as long as their claims_version is the
+    user's current one. Tokens issued before a write to the
+    row, made on another device or deactivating the user, and
+    older tokens without the claims fall back to loading the user
+    """
+    if self.claims_are_current(validated_token):
+      return TokenUser(validated_token)
+
+    user = super().get_user(validated_token)
+    claims_versions.set(user.pk, user.claims_version)
+    return user
+
+  def claims_are_current(self, validated_token):
+    if not all(claim in validated_token for claim in CLAIM_FIELDS):
+      return False
+
+    user_id = int(validated_token[settings.SIMPLE_JWT['USER_ID_CLAIM']])
+    return validated_token['claims_version'] == claims_versions.get(user_id)
+
@@ -0,0 +1,165 @@
+"""
+Benchmarks for the API hot paths
+
+They are not picked up by the test runner, run them with:
+python manage.py test api.benchmarks
+"""
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from .auth import token_cache
+from .models import User, Task, Subtask, Tag, Project
+from .utils_api import AuthUtils
+import time
+
+
+def measure(func, repeat):
+  """
+  Runs func repeat times and returns the elapsed seconds
+  """
+  start = time.perf_counter()
+  for _ in range(repeat):
+    func()
+  return time.perf_counter() - start
+
+
+def count_queries(func):
+  with CaptureQueriesContext(connection) as queries:
+    func()
+  return len(queries)
+
+
+def report(title, rows):
+  print(f'\n{title}')
+  for label, value in rows:
+    print(f'  {label:<40} {value}')
+
+
+
+class AuthThroughputBenchmark(TestCase):
+  repeat = 500
+
+  def setUp(self):
+    token_cache.clear()
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+
+  def requests_per_second(self):
+    elapsed = measure(lambda: self.c.get('/api/me/'), self.repeat)
+    return self.repeat / elapsed
+
+
+  def test_token_cache(self):
+    with override_settings(AUTH_TOKEN_CACHE={'ENABLED': False}):
+      uncached = self.requests_per_second()
+
+    cached = self.requests_per_second()
+
+    report('Authenticated GET /api/me/', [
+      ('token cache off (req/s)', f'{uncached:.0f}'),
+      ('token cache on (req/s)', f'{cached:.0f}'),
+      ('speedup', f'{cached / uncached:.2f}x'),
+    ])
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class RefreshTokenStorageBenchmark(TestCase):
+  endpoints = ['/api/me/', '/api/tasks/', '/api/tags/', '/api/currentMode/']
+
+  def queries_per_endpoint(self, mode):
+    with override_settings(REFRESH_TOKEN_STORAGE={'MODE': mode}):
+      auth = AuthUtils()
+      auth.register({'username': f'user_{mode}', 'password': 'bench_password'})
+      auth.login({'username': f'user_{mode}', 'password': 'bench_password'})
+
+      return [count_queries(lambda: auth.c.get(url)) for url in self.endpoints]
+
+
+  def test_queries_per_request(self):
+    session = self.queries_per_endpoint('session')
+    cookie = self.queries_per_endpoint('cookie')
+
+    report('DB queries per request, refresh token in session vs cookie', [
+      (url, f'{before} -> {after}')
+      for url, before, after in zip(self.endpoints, session, cookie)
+    ])
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class TaskCreateBenchmark(TestCase):
+  repeat = 20
+  shapes = [(0, 0), (1, 1), (5, 10), (10, 20), (20, 50)]
+
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+
+  def create(self, tags, subtasks):
+    return self.c.post('/api/tasks/', {
+      'title': 'Benchmark',
+      'estimated': 1,
+      'tags': [{'name': f'tag_{i}'} for i in range(tags)],
+      'subtasks': [{'title': f'subtask_{i}'} for i in range(subtasks)],
+    }, content_type='application/json')
+
+
+  def test_create_latency(self):
+    rows = []
+
+    for tags, subtasks in self.shapes:
+      queries = count_queries(lambda: self.create(tags, subtasks))
+      elapsed = measure(lambda: self.create(tags, subtasks), self.repeat)
+      rows.append((
+        f'{tags} tags, {subtasks} subtasks',
+        f'{elapsed / self.repeat * 1000:.2f}ms, {queries} queries'))
+
+    report('POST /api/tasks/ latency by tag and subtask count', rows)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class NormalizedFormatBenchmark(TestCase):
+  repeat = 20
+  shapes = [(10, 2), (100, 5), (300, 10)]
+
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+    self.user = User.objects.get(username='test_user')
+
+
+  def create_project(self, tasks, tags):
+    project = Project.objects.create(name=f'{tasks} tasks', user=self.user)
+    tag_objs = [Tag.objects.create(name=f'{tasks}_{i}', user=self.user) for i in range(tags)]
+
+    for i in range(tasks):
+      task = Task.objects.create(title=f'Task {i}', estimated=1, user=self.user, in_project=True)
+      task.tags.add(*tag_objs)
+      Subtask.objects.create(task=task, title='subtask')
+      project.tasks.add(task)
+    return project
+
+
+  def test_response_size_and_latency(self):
+    rows = []
+
+    for tasks, tags in self.shapes:
+      url = f'/api/projects/{self.create_project(tasks, tags).id}/'
+      for label, params in (('nested', {}), ('normalized', {'normalize': 'true'})):
+        size = len(self.c.get(url, params).content)
+        elapsed = measure(lambda: self.c.get(url, params), self.repeat)
+        rows.append((
+          f'{tasks} tasks, {tags} tags, {label}',
+          f'{size / 1024:.1f}KB, {elapsed / self.repeat * 1000:.2f}ms'))
+
+    report('GET /api/projects/<id>/ nested vs ?normalize=true', rows)
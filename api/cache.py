@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class LRUCache:
+    """
+    A bounded, thread safe, in-process cache
+
+    Once max_size entries are stored the least recently used
+    one is evicted. Entries can carry an expiry timestamp,
+    after which they are dropped on read.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under key, or default
+        if it is missing or expired
+        """
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                return default
+
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """
+        Stores value under key, evicting the least
+        recently used entry if the cache is full
+
+        Keyword arguments:
+        expires_at -- unix timestamp after which the entry is dropped
+        """
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        """
+        Deletes every entry whose value matches the predicate
+        """
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items()
+                    if predicate(value)]
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
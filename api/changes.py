@@ -0,0 +1,130 @@
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from .models import Change, User
+from .scopes import UserScope
+from .serializers import (
+    TaskSerializer, TagSerializer, ProjectSerializer,
+    ModesSerializer, StatsSerializer, UserSerializer)
+import time
+
+
+def change_feed_settings():
+    return {
+        'PAGE_SIZE': 100,
+        'MAX_PAGE_SIZE': 500,
+        'RETENTION': 7 * 24 * 3600,
+        **getattr(settings, 'CHANGE_FEED', {})
+    }
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The cursor is older than the change log, load everything again.'
+    default_code = 'cursor_expired'
+
+
+def encode_cursor(change_id, issued_at=None):
+    """
+    Returns the cursor of the entries up to change_id, it
+    carries the time the client had caught up at
+    """
+    return f'{change_id}.{int(issued_at or time.time())}'
+
+
+def decode_cursor(cursor):
+    """
+    Returns the id of the last entry seen through cursor
+    and the time it was issued at
+
+    Raises CursorExpired if the tombstones it may have
+    missed could be compacted away already
+    """
+    try:
+        change_id, issued_at = (int(part) for part in cursor.split('.'))
+    except ValueError:
+        raise ValidationError({'since': 'Not a valid cursor.'})
+
+    if issued_at < time.time() - change_feed_settings()['RETENTION']:
+        raise CursorExpired
+    return change_id, issued_at
+
+
+class ChangeFeed:
+    """
+    The changes of a user's rows since a cursor, each row
+    appears once with its current data or as a tombstone
+
+    Only the ids are logged, the rows are loaded when the
+    feed is read, one query per kind of row
+    """
+
+    def __init__(self, user):
+        scope = UserScope(user)
+        self.user_id = scope.user_id
+        self.kinds = {
+            'task': (lambda: scope.tasks.with_details(), TaskSerializer),
+            'tag': (lambda: scope.tags, TagSerializer),
+            'project': (lambda: scope.projects.with_details(), ProjectSerializer),
+            'mode': (lambda: scope.modes, ModesSerializer),
+            'stats': (lambda: scope.stats, StatsSerializer),
+            'user': (lambda: User.objects.filter(id=scope.user_id), UserSerializer),
+        }
+
+    def head(self):
+        """
+        Returns the cursor of the latest entry, the starting
+        point of a client which has just loaded everything
+        """
+        latest = Change.objects.filter(user_id=self.user_id).order_by('-id').values_list(
+            'id', flat=True).first()
+        return encode_cursor(latest or 0)
+
+    def load(self, kind, ids):
+        """
+        Returns the serialized rows of kind with the given
+        ids by id, rows which are gone are left out
+        """
+        queryset, serializer = self.kinds[kind]
+        rows = queryset().filter(id__in=ids)
+        return {row['id']: row for row in serializer(rows, many=True).data}
+
+    def read(self, since, limit):
+        """
+        Returns the changes after the cursor since, at most
+        limit entries of the log are read
+        """
+        since_id, issued_at = decode_cursor(since)
+        entries = list(Change.objects.filter(
+            user_id=self.user_id, id__gt=since_id).order_by('id').values_list(
+            'id', 'kind', 'object_id', 'deleted')[:limit + 1])
+        more = len(entries) > limit
+        entries = entries[:limit]
+
+        # The last entry of each row wins, and sets its place
+        latest = {}
+        for _, kind, object_id, deleted in entries:
+            latest.pop((kind, object_id), None)
+            latest[(kind, object_id)] = deleted
+
+        saved = {}
+        for (kind, object_id), deleted in latest.items():
+            if not deleted:
+                saved.setdefault(kind, []).append(object_id)
+        rows = {kind: self.load(kind, ids) for kind, ids in saved.items()}
+
+        changes = []
+        for (kind, object_id), deleted in latest.items():
+            data = None if deleted else rows[kind].get(object_id)
+            if data is None:
+                changes.append({'type': kind, 'id': object_id, 'deleted': True})
+            else:
+                changes.append({'type': kind, 'id': object_id, 'data': data})
+
+        # Until the last page is read the client has not caught up
+        return {
+            'cursor': encode_cursor(
+                entries[-1][0] if entries else since_id, issued_at if more else None),
+            'more': more,
+            'changes': changes,
+        }
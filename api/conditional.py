@@ -0,0 +1,79 @@
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from .user_cache import user_cache
+import hashlib
+
+
+class NotModified(Exception):
+    """
+    Raised before the handler runs, the client's copy of
+    the response is still current
+    """
+
+
+class ConditionalGetMixin:
+    """
+    Gives the GET responses of the view a strong ETag, a
+    request whose If-None-Match carries it is answered with 304
+
+    With the shared backend of the user cache the ETag is made
+    of the URL and the versions of the user's resources the view
+    reads, and the 304 is sent before the handler, and its
+    queries, run. The versions are replaced by the signals and,
+    for the writes done with bulk SQL, by every successful write
+    of the view.
+
+    The versions of the local backend miss the writes handled
+    by the other workers, the ETag is then a hash of the rendered
+    response. The 304 saves sending the response, not making it
+
+    Keyword arguments:
+    etag_resources -- the resources of user_cache the responses are made of
+    write_resources -- the resources the writes of the view can change
+    """
+    etag_resources = ()
+    write_resources = ()
+
+    def get_etag(self, request):
+        # The versions are read before the rows, a write in
+        # between makes the next request miss the ETag
+        versions = ':'.join(
+            str(user_cache.version(request.user.id, resource))
+            for resource in self.etag_resources)
+        key = f'{request.user.id}:{request.get_full_path()}:{versions}'
+        return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+    def is_not_modified(self, request, etag):
+        return etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self.etag = None
+        if request.method in ('GET', 'HEAD') and self.etag_resources and user_cache.shared:
+            self.etag = self.get_etag(request)
+            if self.is_not_modified(request, self.etag):
+                raise NotModified
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': self.etag})
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        if (request.method in ('GET', 'HEAD') and self.etag_resources
+                and response.status_code == status.HTTP_200_OK):
+            if getattr(self, 'etag', None) is None:
+                response.render()
+                self.etag = f'"{hashlib.md5(response.content).hexdigest()}"'
+                if self.is_not_modified(request, self.etag):
+                    response = super().finalize_response(
+                        request, Response(status=status.HTTP_304_NOT_MODIFIED), *args, **kwargs)
+            response['ETag'] = self.etag
+        elif request.method not in SAFE_METHODS and response.status_code < 400:
+            user_cache.invalidate(request.user.id, *self.write_resources)
+        return response
@@ -0,0 +1,91 @@
+class Fieldset:
+    """
+    The fields and relations a client asked for through
+    the ?fields= and ?expand= query parameters
+
+    Keyword arguments:
+    fields -- names of the fields to render, dotted names (tasks.title)
+              reach nested serializers. None renders every field
+    expand -- relations rendered as nested objects, the other ones
+              are rendered as lists of ids. None expands every relation
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request):
+        def parse(param):
+            value = request.query_params.get(param)
+            if value is None:
+                return None
+            return {name.strip() for name in value.split(',') if name.strip()}
+
+        return cls(parse('fields'), parse('expand'))
+
+    @staticmethod
+    def _own(names):
+        return {name.split('.')[0] for name in names}
+
+    @staticmethod
+    def _children(names, prefix):
+        return {name[len(prefix) + 1:] for name in names
+                if name.startswith(f'{prefix}.')}
+
+    def includes(self, name):
+        return self.fields is None or name in self._own(self.fields)
+
+    def expands(self, name):
+        return self.expand is None or name in self._own(self.expand)
+
+    def nested(self, name):
+        """
+        Returns the fieldset of the relation name, asking
+        for tasks.title renders the tasks' titles only
+        """
+        fields = None
+        if self.fields is not None:
+            fields = self._children(self.fields, name) or None
+
+        expand = None
+        if self.expand is not None:
+            expand = self._children(self.expand, name)
+
+        return Fieldset(fields, expand)
+
+    def inline(self, names):
+        """
+        Returns the fieldset expanding the relations of names
+        only, their own relations are rendered as ids
+        """
+        return Fieldset(self.fields, set(names))
+
+    def with_ids(self):
+        """
+        Returns the fieldset rendering the id of every object
+        it renders fields of, asking for tasks.title renders
+        the tasks' ids too
+        """
+        if self.fields is None:
+            return self
+
+        fields = {'id', *self.fields}
+        for name in self.fields:
+            parts = name.split('.')
+            fields.update('.'.join([*parts[:depth], 'id']) for depth in range(1, len(parts)))
+        return Fieldset(fields, self.expand)
+
+    def only(self, model, *required):
+        """
+        Returns the model's columns to load, or None to load
+        all of them
+
+        Keyword arguments:
+        required -- columns loaded even if they were not asked for
+        """
+        if self.fields is None:
+            return None
+
+        columns = {field.name for field in model._meta.concrete_fields}
+        return ['id', *required, *sorted(self._own(self.fields) & columns)]
@@ -0,0 +1,14 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.changes import change_feed_settings
+from api.models import Change
+
+
+class Command(BaseCommand):
+    help = 'Compacts the change log, meant to be run periodically'
+
+    def handle(self, *args, **options):
+        retention = timedelta(seconds=change_feed_settings()['RETENTION'])
+        deleted = Change.objects.compact(timezone.now() - retention)
+        self.stdout.write(f'Deleted {deleted} change log entries')
@@ -1,66 +1,100 @@
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
+from rest_framework_simplejwt.exceptions import TokenError
 from django.conf import settings
+from .auth import (
+  add_claims, user_claims, set_access_cookie, token_cache,
+  get_refresh_token, clear_refresh_token, has_refresh_token)
+from .models import User
+from .revocation import revoked_tokens
 
 class TokenRefreshMiddleware:
+  excluded_routes = ['/api/auth/login/', '/api/auth/register/', '/api/auth/logout/']
+
   def __init__(self, get_response):
     self.get_response = get_response
 
   def __call__(self, request):
+    # Use this middleware everywhere except the auth routes
+    if request.path in self.excluded_routes:
+      return self.get_response(request)
+
+    # The refresh decision is taken before the view runs,
+    # so the view is only executed once per request
+    try:
+      new_access_token, set_cookie = self.refresh_access_token(request)
+    except TokenError:
+      # If the refresh token is no longer valid, logout the user
+      response = self.get_response(request)
+      response.delete_cookie('access_token')
+      clear_refresh_token(request, response)
+      return response
+
+    if new_access_token is not None:
+      # Set the new cookie on the server
+      request.COOKIES['access_token'] = str(new_access_token)
+
     response = self.get_response(request)
-    refresh_token = request.session.get('refresh')
-
-    excluded_routes = ['/api/auth/login/', '/api/auth/register/', '/api/auth/logout/']
-    
-    # Use this middleware everywhere except the login route
-    if request.path not in excluded_routes:
-      # Check if the refresh token is still valid
-      try:
-        # Set the new set of tokens based on the refresh token
-        # stored in the user's session
-        new_tokens = RefreshToken(refresh_token)
-        # If the refresh token is still valid, try to refresh the access token
-        try:
-          access_token = request.COOKIES.get('access_token')
-          if access_token:
-            AccessToken(access_token)
-          else:
-            # In case the access token is deleted, set a new one
-            request.COOKIES['access_token'] = str(new_tokens.access_token)
-
-            response = self.get_response(request)
-
-            # Sessionid means the user is logged in
-            if request.COOKIES.get('sessionid'):
-              response.set_cookie(
-                'access_token',
-                new_tokens.access_token,
-                max_age=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'],
-                httponly=settings.SIMPLE_JWT['AUTH_COOKIE_HTTP_ONLY'],
-                samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE'],
-                secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE']
-              ) 
-            # except the AccessToken() call
-        except:
-          # Set the new cookie on the server
-          request.COOKIES['access_token'] = str(new_tokens.access_token)
-
-          response = self.get_response(request)
-
-          # Set the new cookie on the client
-          response.set_cookie(
-            'access_token',
-            new_tokens.access_token,
-            max_age=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'],
-            httponly=settings.SIMPLE_JWT['AUTH_COOKIE_HTTP_ONLY'],
-            samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE'],
-            secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE']
-          )
-        # except the RefreshToken() call
-      except:
-        # If the refresh token is no longer valid, logout the user
-        request.session = {}
-        response = self.get_response(request)
-        response.delete_cookie('access_token')
-        response.delete_cookie('sessionid')
-    
-    return response
\ No newline at end of file
+
+    if set_cookie:
+      # Set the new cookie on the client
+      set_access_cookie(response, new_access_token)
+
+    return response
+
+  def refresh_access_token(self, request):
+    """
+    Checks the tokens of the request without running the view
+
+    Returns a (new access token, set cookie) pair, the new access
+    token is None when the current one is still valid.
+
+    Raises TokenError if the refresh token is no longer valid
+    """
+    refresh_token = get_refresh_token(request)
+
+    # Without a refresh token there is nothing to refresh,
+    # the authentication class deals with the access token
+    if refresh_token is None:
+      return None, False
+
+    # Set the new set of tokens based on the refresh token
+    new_tokens = RefreshToken(refresh_token)
+
+    if revoked_tokens.is_revoked(new_tokens[settings.SIMPLE_JWT['JTI_CLAIM']]):
+      raise TokenError('Token has been revoked')
+
+    access_token = request.COOKIES.get('access_token')
+
+    if not access_token:
+      # In case the access token is deleted, set a new one
+      # if the user is logged in
+      return self.new_access_token(new_tokens), has_refresh_token(request)
+
+    try:
+      AccessToken(access_token)
+    except TokenError:
+      # The access token expired, refresh it
+      return self.new_access_token(new_tokens), True
+
+    return None, False
+
+  def new_access_token(self, refresh_token):
+    """
+    Returns an access token built from the refresh token, with the
+    claims read from the user's row since the ones copied from
+    the refresh token date back to the login
+
+    The user is already loaded, so it primes the token cache
+    and the authentication doesn't load it a second time
+    """
+    access_token = refresh_token.access_token
+    user = User.objects.filter(
+      id=access_token[settings.SIMPLE_JWT['USER_ID_CLAIM']]).first()
+
+    if user is not None:
+      access_token = add_claims(access_token, user_claims(user))
+
+      if token_cache.enabled:
+        token_cache.set(str(access_token), access_token, user)
+
+    return access_token
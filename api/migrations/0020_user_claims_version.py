@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_alter_mode_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='claims_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
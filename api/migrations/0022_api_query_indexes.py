@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'in_project', '-id'], name='task_user_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['user', '-id'], name='project_user_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stats',
+            index=models.Index(fields=['user', 'day'], name='stats_user_day_idx'),
+        ),
+        # Task.tags has no through model to declare it on, TagInfo
+        # reads the tasks of a tag out of the index alone
+        migrations.RunSQL(
+            'CREATE INDEX task_tags_tag_task_idx ON api_task_tags (tag_id, task_id);',
+            'DROP INDEX task_tags_tag_task_idx;',
+        ),
+    ]
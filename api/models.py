@@ -1,6 +1,41 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, connections, transaction
+from django.db.models import Prefetch, Max
 from django.utils import timezone
+from contextlib import contextmanager
+from .fieldsets import Fieldset
+from .user_cache import user_cache
+import threading
+import time
+
+
+class TagQuerySet(models.QuerySet):
+    def get_or_create_many(self, user, names):
+        """
+        Returns the user's tags with the given names,
+        the missing ones are created in a single INSERT
+
+        Keyword arguments:
+        names -- the names of the tags, duplicates are ignored
+        """
+        names = list(dict.fromkeys(names))
+        tags = {tag.name: tag for tag in self.filter(user=user, name__in=names)}
+        missing = [name for name in names if name not in tags]
+
+        if missing:
+            # Tags created by a concurrent request are skipped
+            # and read back along with the new ones
+            self.bulk_create(
+                [Tag(user=user, name=name) for name in missing],
+                ignore_conflicts=True)
+            # bulk_create sends no post_save
+            user_cache.invalidate(user.id, 'tags')
+            tags.update(
+                (tag.name, tag) for tag in self.filter(user=user, name__in=missing))
+            Change.objects.record(
+                user.id, 'tag', [tags[name].id for name in missing])
+
+        return [tags[name] for name in names]
 
 
 class Tag(models.Model):
@@ -10,6 +45,8 @@ class Tag(models.Model):
         related_name='tags')
     name = models.CharField(max_length=20)
 
+    objects = TagQuerySet.as_manager()
+
     class Meta:
         unique_together = (('name', 'user'),)
 
@@ -22,6 +59,128 @@ class User(AbstractUser):
     current_mode_id = models.IntegerField(default=0, null=True)
     auto_start_pomos = models.BooleanField(default=False)
     auto_start_breaks = models.BooleanField(default=False)
+    # Replaced by every write to the row, the tokens carry the
+    # version their claims were read at, see ClaimsAuthentication
+    claims_version = models.BigIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        self.claims_version = time.time_ns()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'claims_version'}
+        super().save(*args, **kwargs)
+
+
+class TaskQuerySet(models.QuerySet):
+    def with_details(self, fieldset=None):
+        """
+        Prefetches the relations rendered by TaskSerializer,
+        so any number of tasks is serialized in a fixed
+        number of queries
+
+        Keyword arguments:
+        fieldset -- only loads the columns and relations it asks for,
+                    relations not expanded are loaded as ids
+        """
+        fieldset = fieldset or Fieldset()
+        relations = {
+            'tags': (Tag.objects.all(), Tag.objects.only('id')),
+            'subtasks': (Subtask.objects.all(), Subtask.objects.only('id', 'task')),
+            'project_tasks': (
+                Project.objects.prefetch_related(
+                    Prefetch('tasks', queryset=Task.objects.only('id'))),
+                Project.objects.only('id')),
+        }
+
+        lookups = [
+            Prefetch(name, queryset=expanded if fieldset.expands(name) else ids)
+            for name, (expanded, ids) in relations.items()
+            if fieldset.includes(name)
+        ]
+
+        queryset = self.prefetch_related(*lookups)
+        only = fieldset.only(Task)
+        return queryset if only is None else queryset.only(*only)
+
+    def delete_in_bulk(self):
+        """
+        Deletes the tasks with one DELETE per table, whatever
+        their number. The tasks are not loaded, so no delete
+        signals are sent. Returns the ids of the deleted tasks
+        and of the tags they had
+        """
+        ids = list(self.values_list('id', flat=True))
+        if not ids:
+            return [], []
+
+        tag_ids = list(Task.tags.through.objects.filter(
+            task_id__in=ids).values_list('tag_id', flat=True).distinct())
+
+        Subtask.objects.filter(task_id__in=ids).delete()
+        Task.tags.through.objects.filter(task_id__in=ids).delete()
+        Project.tasks.through.objects.filter(task_id__in=ids).delete()
+        # Task.objects.delete() would collect every task to send the signals
+        Task.objects.filter(id__in=ids)._returning(
+            'DELETE FROM {task} WHERE id IN ({tasks}) RETURNING id', [])
+
+        return ids, tag_ids
+
+    def _returning(self, sql, params):
+        """
+        Runs sql, which reads the tasks' ids out of the queryset
+        through the {tasks} placeholder, and returns the first
+        column of the rows it returns
+        """
+        connection = connections[self.db]
+        tasks, tasks_params = self.order_by().values('id').query.sql_with_params()
+        tables = {
+            model._meta.model_name: connection.ops.quote_name(model._meta.db_table)
+            for model in (Task, Project.tasks.through)}
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(tasks=tasks, **tables), [*params, *tasks_params])
+            return [row[0] for row in cursor.fetchall()]
+
+    def set_done(self, done):
+        """
+        Sets done on every task in a single UPDATE,
+        returns the ids of the updated tasks
+        """
+        return self._returning(
+            'UPDATE {task} SET done = %s WHERE id IN ({tasks}) RETURNING id', [done])
+
+    def add_to_project(self, project):
+        """
+        Adds the tasks to the project in a single INSERT,
+        returns the ids of the tasks which were not in it
+        """
+        return self._returning(
+            'INSERT INTO {project_tasks} (project_id, task_id) '
+            'SELECT %s, id FROM {task} WHERE id IN ({tasks}) '
+            'ON CONFLICT (project_id, task_id) DO NOTHING RETURNING task_id',
+            [project.id])
+
+    def remove_from_project(self, project):
+        """
+        Removes the tasks from the project in a single DELETE,
+        returns the ids of the tasks which were in it
+        """
+        return self._returning(
+            'DELETE FROM {project_tasks} WHERE project_id = %s '
+            'AND task_id IN ({tasks}) RETURNING task_id',
+            [project.id])
+
+    def increment_gone_through(self, pk):
+        """
+        Adds one to the task's gone_through in a single UPDATE,
+        returns the new value or None if there is no such task
+        in the queryset
+        """
+        values = self.filter(id=pk)._returning(
+            'UPDATE {task} SET gone_through = gone_through + 1 '
+            'WHERE id IN ({tasks}) RETURNING gone_through', [])
+        return values[0] if values else None
 
 
 class Task(models.Model):
@@ -37,6 +196,14 @@ class Task(models.Model):
     done = models.BooleanField(default=False)
     in_project = models.BooleanField(default=False)
 
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # user.tasks.filter(in_project=False).order_by('-id')
+            models.Index(fields=['user', 'in_project', '-id'], name='task_user_list_idx'),
+        ]
+
     def __str__(self):
         return f'Task: {self.title}'
 
@@ -54,6 +221,30 @@ class Subtask(models.Model):
         return f'Subtask: {self.title} - {self.done}'
 
 
+class ProjectQuerySet(models.QuerySet):
+    def with_details(self, fieldset=None):
+        """
+        Prefetches the whole tree rendered by ProjectSerializer,
+        projects -> tasks -> tags, subtasks and projects, in
+        a fixed number of queries
+
+        Keyword arguments:
+        fieldset -- only loads the columns and relations it asks for,
+                    tasks.title loads the titles of the tasks only
+        """
+        fieldset = fieldset or Fieldset()
+        queryset = self
+
+        if fieldset.includes('tasks'):
+            tasks = Task.objects.only('id')
+            if fieldset.expands('tasks'):
+                tasks = Task.objects.with_details(fieldset.nested('tasks'))
+            queryset = queryset.prefetch_related(Prefetch('tasks', queryset=tasks))
+
+        only = fieldset.only(Project)
+        return queryset if only is None else queryset.only(*only)
+
+
 class Project(models.Model):
     name = models.CharField(max_length=30)
     user = models.ForeignKey(
@@ -63,10 +254,42 @@ class Project(models.Model):
     tasks = models.ManyToManyField(
         'Task', blank=True, related_name='project_tasks')
 
+    objects = ProjectQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # user.projects.order_by('-id')
+            models.Index(fields=['user', '-id'], name='project_user_list_idx'),
+        ]
+
     def __str__(self):
         return f'Project: {self.name}'
 
 
+class StatsQuerySet(models.QuerySet):
+    def increment_chores(self, user_id, day):
+        """
+        Adds one to the chores done by the user on day, the
+        row is created if it is missing. A single upsert, so
+        concurrent calls neither lose an increment nor fail
+        on the unique constraint
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        day = self.model._meta.get_field('day').to_python(day)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (day, user_id, chores_done) VALUES (%s, %s, 1) '
+                'ON CONFLICT (day, user_id) '
+                f'DO UPDATE SET chores_done = {table}.chores_done + 1 '
+                'RETURNING id, chores_done',
+                [connection.ops.adapt_datefield_value(day), user_id])
+            pk, chores_done = cursor.fetchone()
+
+        return self.model(id=pk, day=day, user_id=user_id, chores_done=chores_done)
+
+
 class Stats(models.Model):
     day = models.DateField(default=timezone.now, null=False)
     chores_done = models.IntegerField(default=0)
@@ -75,9 +298,16 @@ class Stats(models.Model):
         on_delete=models.CASCADE,
         related_name='stats')
 
+    objects = StatsQuerySet.as_manager()
+
 
     class Meta:
         unique_together = (('day', 'user'),)
+        indexes = [
+            # user.stats.order_by('day'), the unique
+            # constraint starts with the day instead
+            models.Index(fields=['user', 'day'], name='stats_user_day_idx'),
+        ]
 
 
     def __str__(self):
@@ -96,3 +326,110 @@ class Mode(models.Model):
 
     def __str__(self):
         return f'Mode: {self.name} - User: {self.user}'
+
+
+# The built-in mode of users whose current_mode_id is 0,
+# it is never saved and has the model's default timers
+DEFAULT_MODE = Mode(id=0, name='Default')
+
+
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=255, unique=True)
+    # Once the token expires the row is no longer needed
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'Revoked token: {self.jti}'
+
+
+class ChangeQuerySet(models.QuerySet):
+    # The entries recorded inside batch(), per thread
+    _pending = threading.local()
+
+    def record(self, user_id, kind, ids, deleted=False):
+        """
+        Appends an entry per id to the user's change log,
+        or keeps them for the end of the current batch()
+
+        Keyword arguments:
+        kind -- one of Change.KINDS
+        deleted -- the rows are gone, the entries are tombstones
+        """
+        changes = [
+            Change(user_id=user_id, kind=kind, object_id=object_id, deleted=deleted)
+            for object_id in dict.fromkeys(ids)]
+
+        pending = getattr(self._pending, 'changes', None)
+        if pending is not None:
+            pending.extend(changes)
+        elif changes:
+            self.bulk_create(changes)
+
+    @contextmanager
+    def batch(self):
+        """
+        Records the entries of the block in a single INSERT when
+        it exits, nothing is recorded if it raises or marks its
+        transaction for rollback. Used inside the transaction of
+        the writes so both are kept or lost together
+        """
+        if getattr(self._pending, 'changes', None) is not None:
+            yield
+            return
+
+        self._pending.changes = []
+        try:
+            yield
+            changes = self._pending.changes
+        finally:
+            self._pending.changes = None
+
+        connection = transaction.get_connection(self.db)
+        if connection.in_atomic_block and connection.get_rollback():
+            return
+        if changes:
+            self.bulk_create(changes)
+
+    def compact(self, tombstones_before):
+        """
+        Deletes the entries followed by a newer one of the same
+        row and the tombstones older than tombstones_before, the
+        log keeps at most one entry per row
+
+        Cursors issued before tombstones_before may have missed
+        a deleted tombstone, the feed turns them down
+        """
+        latest = self.values('user_id', 'kind', 'object_id').annotate(
+            latest_id=Max('id')).values('latest_id')
+
+        superseded, _ = self.exclude(id__in=latest).delete()
+        expired, _ = self.filter(deleted=True, created_at__lt=tombstones_before).delete()
+        return superseded + expired
+
+
+class Change(models.Model):
+    """
+    An entry of a user's append-only change log, the id
+    orders the entries and makes the feed's cursor
+    """
+    KINDS = ('task', 'tag', 'project', 'mode', 'stats', 'user')
+
+    # Not a foreign key, the entries of a user's rows are
+    # recorded while its deletion cascades to them
+    user_id = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=[(kind, kind) for kind in KINDS])
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = ChangeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # user.changes.filter(id__gt=cursor).order_by('id')
+            models.Index(fields=['user_id', 'id'], name='change_user_feed_idx'),
+        ]
+
+    def __str__(self):
+        action = 'deleted' if self.deleted else 'saved'
+        return f'Change: {self.kind} {self.object_id} {action}'
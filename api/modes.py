@@ -0,0 +1,26 @@
+from .models import Mode, DEFAULT_MODE
+from .serializers import ModesSerializer
+from .user_cache import user_cache
+
+
+def user_modes(user_id):
+    """
+    Returns the user's serialized modes, read through
+    the user cache. user_id may be the str of a TokenUser,
+    the entries are keyed on the int the signals use
+    """
+    user_id = int(user_id)
+    return user_cache.fetch(user_id, 'modes', lambda: list(
+        ModesSerializer(Mode.objects.filter(user_id=user_id), many=True).data))
+
+
+def current_mode(user_id, mode_id):
+    """
+    Returns the user's serialized mode with the id of mode_id,
+    the built-in default one for 0 or a mode that is gone
+    """
+    if mode_id:
+        for mode in user_modes(user_id):
+            if mode['id'] == int(mode_id):
+                return mode
+    return ModesSerializer(DEFAULT_MODE).data
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from django.conf import settings
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.response import Response
+from .cache import LRUCache
+import time
+
+
+def row_count_settings():
+    return {
+        'MAX_SIZE': 4096,
+        'TTL': 300,
+        **getattr(settings, 'ROW_COUNT_CACHE', {})
+    }
+
+
+class RowCounter:
+    """
+    Row counts kept in-process, so paginated responses
+    can carry a count without a COUNT(*)
+
+    Counts are keyed by the user, or the tag, whose rows
+    they count and are dropped whenever one of those rows
+    is saved or deleted, see signals.py. Entries live at
+    most TTL seconds, which bounds how stale the count of
+    another worker can get.
+    """
+
+    def __init__(self, max_size):
+        self.entries = LRUCache(max_size)
+
+    def count(self, key, queryset):
+        """
+        Returns the cached count of key's rows,
+        counting the queryset on a miss
+        """
+        count = self.entries.get(key)
+        if count is None:
+            count = queryset.count()
+            self.entries.set(
+                key, count, time.time() + row_count_settings()['TTL'])
+        return count
+
+    def invalidate(self, key):
+        self.entries.delete(key)
+
+    def clear(self):
+        self.entries.clear()
+
+
+row_counters = {
+    'tasks': RowCounter(row_count_settings()['MAX_SIZE']),
+    'projects': RowCounter(row_count_settings()['MAX_SIZE']),
+    'tags': RowCounter(row_count_settings()['MAX_SIZE']),
+}
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Pages through the rows by id, the cursors are opaque
+    and stay stable when rows are inserted or deleted
+    between page loads
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    counter = None
+
+    def __init__(self, page_size=None, max_page_size=None, counter=None):
+        self.page_size = page_size or self.page_size
+        self.max_page_size = max_page_size or self.max_page_size
+        self.counter = counter or self.counter
+
+    def get_count(self, queryset, request):
+        """
+        Returns the cached count asked for with ?count=true,
+        or None
+        """
+        if self.counter is None or request.query_params.get('count') not in ('true', '1'):
+            return None
+        return row_counters[self.counter].count(request.user.id, queryset)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+            response.move_to_end('count', last=False)
+        return Response(response)
+
+
+class OptionalCursorPagination(PageNumberPagination):
+    """
+    Page number pagination, switched to keyset pagination
+    when the request carries a ?cursor= parameter, an empty
+    one asks for the first page
+
+    Keyword arguments:
+    counter -- name of the row counter used for ?count=true
+               in cursor mode
+    """
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    counter = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination(
+                self.page_size, self.max_page_size, self.counter)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
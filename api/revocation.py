@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.utils import timezone
+from threading import Lock
+from .models import RevokedToken
+import datetime
+import hashlib
+import time
+
+
+def revocation_settings():
+    return {
+        'BLOOM_BITS': 2 ** 20,
+        'BLOOM_HASHES': 7,
+        'SYNC_INTERVAL': 5,
+        **getattr(settings, 'REVOKED_TOKENS', {})
+    }
+
+
+class BloomFilter:
+    """
+    A fixed size set which can only answer
+    "definitely not in it" or "maybe in it"
+    """
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        return all(
+            self._array[position // 8] & (1 << (position % 8))
+            for position in self._positions(key))
+
+
+class RevocationList:
+    """
+    Revoked token ids, kept in the RevokedToken table with
+    an in-process Bloom filter in front of it
+
+    Most tokens were never revoked, the filter rules them out
+    without a query. Only the ones it might contain are
+    looked up in the table.
+    """
+
+    def __init__(self):
+        self._filter = None
+        self._synced_at = None
+        self._lock = Lock()
+
+    def sync(self):
+        """
+        Rebuilds the filter out of the tokens which are
+        not expired yet, it only reads the table
+        """
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        options = revocation_settings()
+
+        bloom = BloomFilter(options['BLOOM_BITS'], options['BLOOM_HASHES'])
+        revoked = RevokedToken.objects.filter(expires_at__gt=timezone.now())
+        for jti in revoked.values_list('jti', flat=True).iterator():
+            bloom.add(jti)
+
+        self._filter = bloom
+        self._synced_at = time.monotonic()
+
+    def _sync_if_needed(self):
+        if not self._needs_sync():
+            return
+
+        with self._lock:
+            # Rebuilt already by the thread this one waited for
+            if self._needs_sync():
+                self._rebuild()
+
+    def compact(self):
+        """
+        Deletes the rows of expired tokens, done when a token
+        is revoked so the requests which only read the table
+        never take its write lock
+        """
+        RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    def _needs_sync(self):
+        """
+        The filter is built on first use, and rebuilt every
+        SYNC_INTERVAL seconds to pick up the tokens revoked
+        by other processes. None never rebuilds it, only for
+        a single process
+        """
+        if self._filter is None:
+            return True
+
+        interval = revocation_settings()['SYNC_INTERVAL']
+        return interval is not None and time.monotonic() - self._synced_at >= interval
+
+    def revoke(self, token):
+        """
+        Revokes a validated token until it expires
+
+        Keyword arguments:
+        token -- a simplejwt token, access or refresh
+        """
+        jti = token[settings.SIMPLE_JWT['JTI_CLAIM']]
+        expires_at = datetime.datetime.fromtimestamp(token['exp'], tz=datetime.timezone.utc)
+
+        RevokedToken.objects.get_or_create(jti=jti, defaults={'expires_at': expires_at})
+        self.compact()
+        self._sync_if_needed()
+
+        with self._lock:
+            self._filter.add(jti)
+
+    def is_revoked(self, jti):
+        self._sync_if_needed()
+
+        if jti not in self._filter:
+            return False
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+
+revoked_tokens = RevocationList()
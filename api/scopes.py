@@ -0,0 +1,60 @@
+from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+from .models import Task, Subtask, Tag, Project, Mode, Stats
+
+
+class UserScope:
+    """
+    The rows of one user, the views fetch through it so
+    every lookup is a single ownership-filtered query
+
+    Rows of other users are never returned, looking
+    one up raises a HTTP404 error like a missing row
+    """
+
+    def __init__(self, user):
+        self.user_id = user.id
+
+    @property
+    def tasks(self):
+        return Task.objects.filter(user_id=self.user_id)
+
+    @property
+    def subtasks(self):
+        # The task comes along the join, its writes are logged by the task's user
+        return Subtask.objects.filter(task__user_id=self.user_id).select_related('task')
+
+    @property
+    def tags(self):
+        return Tag.objects.filter(user_id=self.user_id)
+
+    @property
+    def projects(self):
+        return Project.objects.filter(user_id=self.user_id)
+
+    @property
+    def modes(self):
+        return Mode.objects.filter(user_id=self.user_id)
+
+    @property
+    def stats(self):
+        return Stats.objects.filter(user_id=self.user_id)
+
+    def get(self, queryset, **lookups):
+        """
+        Returns the row of queryset matching lookups,
+        raises a HTTP404 error if there is none
+
+        Keyword arguments:
+        queryset -- one of the scope's querysets
+        """
+        return get_object_or_404(queryset, **lookups)
+
+
+class UserScopeMixin:
+    """
+    Gives the view the current user's scope
+    """
+    @cached_property
+    def scope(self):
+        return UserScope(self.request.user)
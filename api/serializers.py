@@ -1,5 +1,69 @@
 from .models import *
+from .auth import add_claims, user_claims
+from .fieldsets import Fieldset
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+
+class FieldsetMixin:
+    """
+    Renders only the fields of the fieldset passed as
+    the fieldset keyword argument, relations that are not
+    expanded are rendered as lists of ids
+    """
+    # Relations which can be rendered either nested or as ids
+    expandable_fields = ()
+    # Serializers of the expandable fields taking a fieldset of their own
+    nested_serializers = {}
+    # Expandable fields the normalized format keeps nested
+    inline_fields = ()
+
+    def __init__(self, *args, fieldset=None, **kwargs):
+        self.fieldset = fieldset or Fieldset()
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        for name in list(fields):
+            if not self.fieldset.includes(name):
+                del fields[name]
+            elif name not in self.expandable_fields:
+                continue
+            elif not self.fieldset.expands(name):
+                fields[name] = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+            elif name in self.nested_serializers:
+                fields[name] = self.nested_serializers[name](
+                    many=True, fieldset=self.fieldset.nested(name))
+
+        return fields
+
+    def side_load(self, instances, included):
+        """
+        Adds the objects related to instances to included, by
+        field name and id, each one rendered once the way the
+        expanded field renders it
+
+        The serializer has to expand the relations, and their
+        objects have to be prefetched
+
+        Keyword arguments:
+        included -- dict of field name -> {id: object}, filled in place
+        """
+        for name in self.expandable_fields:
+            field = self.fields.get(name)
+            if field is None:
+                continue
+
+            related = [obj for instance in instances for obj in getattr(instance, name).all()]
+            if name in self.inline_fields:
+                field.child.side_load(related, included)
+                continue
+
+            rendered = included.setdefault(name, {})
+            for obj in related:
+                if obj.pk not in rendered:
+                    rendered[obj.pk] = field.child.to_representation(obj)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -32,7 +96,9 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(FieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = ('tags', 'subtasks', 'project_tasks')
+
     class Meta:
         model = Task
         fields = [
@@ -54,13 +120,38 @@ class SubtaskSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description', 'done']
 
 
-class ProjectSerializer(serializers.ModelSerializer):
-    def get_fields(self):
-        fields = super(ProjectSerializer, self).get_fields()
-        fields['tasks'] = TaskSerializer(many=True)
-        return fields
+class BulkTasksSerializer(serializers.Serializer):
+    """
+    The body of the bulk task endpoints
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    done = serializers.BooleanField(required=False, default=True)
+
+
+class BulkProjectTasksSerializer(BulkTasksSerializer):
+    """
+    The body of the bulk endpoints which move tasks
+    in and out of a project
+    """
+    project_id = serializers.IntegerField()
+
+
+class ProjectSerializer(FieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = ('tasks',)
+    nested_serializers = {'tasks': TaskSerializer}
+    inline_fields = ('tasks',)
 
     class Meta:
         model = Project
         fields = ['id', 'name', 'tasks']
         depth = 2
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Embeds the user's claims in the tokens issued at login,
+    the access token copies them from the refresh token
+    """
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user_claims(user))
@@ -0,0 +1,187 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .auth import token_cache, claims_versions
+from .models import User, Task, Subtask, Project, Tag, Mode, Stats, Change
+from .pagination import row_counters
+from .user_cache import user_cache, RESOURCES
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_tokens(sender, instance, **kwargs):
+    """
+    Cached tokens carry a snapshot of the user's row,
+    drop them whenever the row changes
+    """
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def update_claims_version(sender, instance, **kwargs):
+    # save() gave the row a new version
+    if instance.is_active:
+        claims_versions.set(instance.pk, instance.claims_version)
+    else:
+        claims_versions.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def drop_claims_version(sender, instance, **kwargs):
+    claims_versions.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, created, **kwargs):
+    """
+    Drops the cached info of the user, a new user drops
+    anything left under its id
+    """
+    resources = RESOURCES if created else ('me',)
+    user_cache.invalidate(instance.pk, *resources)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk, *RESOURCES)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def invalidate_task_count(sender, instance, **kwargs):
+    row_counters['tasks'].invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_count(sender, instance, **kwargs):
+    row_counters['projects'].invalidate(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+def invalidate_tag_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drops the counts of the tags whose tasks changed,
+    tag.tasks.add() sends the tag as the instance
+    """
+    if reverse:
+        row_counters['tags'].invalidate(instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        for tag_id in pk_set:
+            row_counters['tags'].invalidate(tag_id)
+    elif action == 'pre_clear':
+        for tag_id in instance.tags.values_list('id', flat=True):
+            row_counters['tags'].invalidate(tag_id)
+
+
+@receiver(pre_delete, sender=Task)
+def invalidate_deleted_task_tag_counts(sender, instance, **kwargs):
+    # The through rows are deleted along with the task, without m2m_changed
+    for tag_id in instance.tags.values_list('id', flat=True):
+        row_counters['tags'].invalidate(tag_id)
+
+
+@receiver(post_delete, sender=Tag)
+def invalidate_deleted_tag_count(sender, instance, **kwargs):
+    row_counters['tags'].invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_cached_tags(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id, 'tags')
+
+
+@receiver(post_save, sender=Mode)
+@receiver(post_delete, sender=Mode)
+def invalidate_cached_modes(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id, 'modes')
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+@receiver(m2m_changed, sender=Task.tags.through)
+def bump_task_version(sender, instance, **kwargs):
+    # tag.tasks.add() sends the tag, it has a user_id too
+    user_cache.invalidate(instance.user_id, 'tasks')
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(m2m_changed, sender=Project.tasks.through)
+def bump_project_version(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id, 'projects')
+
+
+@receiver(post_save, sender=Stats)
+@receiver(post_delete, sender=Stats)
+def bump_stats_version(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id, 'stats')
+
+
+@receiver(post_save, sender=Subtask)
+def bump_subtask_version(sender, instance, **kwargs):
+    """
+    Subtasks are rendered inside their task and its projects,
+    deleting one is left to the views as for the change log
+    """
+    user_cache.invalidate(instance.task.user_id, 'tasks', 'projects')
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Mode)
+@receiver(post_save, sender=Stats)
+def record_saved(sender, instance, **kwargs):
+    Change.objects.record(instance.user_id, sender._meta.model_name, [instance.pk])
+
+
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Mode)
+@receiver(post_delete, sender=Stats)
+def record_deleted(sender, instance, **kwargs):
+    Change.objects.record(
+        instance.user_id, sender._meta.model_name, [instance.pk], deleted=True)
+
+
+@receiver(post_save, sender=User)
+def record_user_change(sender, instance, **kwargs):
+    Change.objects.record(instance.pk, 'user', [instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def delete_user_changes(sender, instance, **kwargs):
+    # Sent once the rows of the user are deleted, and logged
+    Change.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Subtask)
+def record_subtask_change(sender, instance, **kwargs):
+    """
+    Subtasks are part of their task, the task is logged
+    instead. Deleting one is logged by the views, a
+    post_delete receiver would have every deleted task
+    load its subtasks
+    """
+    Change.objects.record(instance.task.user_id, 'task', [instance.task_id])
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+def record_task_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # tag.tasks.add() sends the tag and the ids of the tasks
+    ids = (pk_set or []) if reverse else [instance.pk]
+    Change.objects.record(instance.user_id, 'task', ids)
+
+
+@receiver(m2m_changed, sender=Project.tasks.through)
+def record_project_tasks_change(sender, instance, action, reverse, pk_set, model, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # task.project_tasks.remove() sends the task and the ids of the projects
+    with Change.objects.batch():
+        Change.objects.record(instance.user_id, instance._meta.model_name, [instance.pk])
+        Change.objects.record(instance.user_id, model._meta.model_name, pk_set or [])
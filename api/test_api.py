@@ -1,8 +1,27 @@
-from django.test import TestCase, Client
-from .models import Task, Project, Subtask, Tag, Stats, Mode, User
+from django.test import TestCase, Client, override_settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from .models import Task, Project, Subtask, Tag, Stats, Mode, User, RevokedToken, Change
 from .serializers import *
 from .utils_api import AuthUtils
+from .views import CurrentUserView, StatsViewSet
+from .auth import token_cache, access_token_for, token_cache_settings
+from .revocation import revoked_tokens, BloomFilter
+from .pagination import row_counters
+from .user_cache import user_cache
+from .models import DEFAULT_MODE
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+from unittest import mock, skipUnless
+from datetime import timedelta
+from django.utils import timezone
+import jwt
+import os
+import tempfile
+import threading
+import time
 
 
 
@@ -1210,7 +1229,8 @@ class CurrentModeTestCase(TestCase):
   def test_no_mode(self):
     response = self.c.get('/api/currentMode/')
 
-    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json(), ModesSerializer(DEFAULT_MODE).data)
 
   
   def test_mode_post(self):
@@ -1250,6 +1270,7 @@ class TagInfoTestCase(TestCase):
     self.c = Client()
     self.c.cookies['access_token'] = auth.access_token
 
+    row_counters['tags'].clear()
     user = User.objects.first()
 
     self.task_1 = {
@@ -1288,30 +1309,67 @@ class TagInfoTestCase(TestCase):
 
 
   def test_tasks_inside_tag(self):
-    django = self.c.get('/api/tagInfo/django/')
-    rest = self.c.get('/api/tagInfo/rest/')
-    docs = self.c.get('/api/tagInfo/docs/')
-    auth = self.c.get('/api/tagInfo/auth/')
-
-
-    django_tag = Tag.objects.get(name='django')
-    self.assertEqual(django.json(), TaskSerializer(django_tag.tasks, many=True).data)
-    self.assertEqual(django_tag.tasks.count(), 2)
-    # docs 2
-    docs_tag = Tag.objects.get(name='docs')
-    self.assertEqual(docs.json(), TaskSerializer(docs_tag.tasks, many=True).data)
-    self.assertEqual(docs_tag.tasks.count(), 2)
-
-    # auth 1
-    auth_tag = Tag.objects.get(name='auth')
-    self.assertEqual(auth.json(), TaskSerializer(auth_tag.tasks, many=True).data)
-    self.assertEqual(auth_tag.tasks.count(), 1)
-    # rest 1
-    rest_tag = Tag.objects.get(name='rest')
-    self.assertEqual(rest.json(), TaskSerializer(rest_tag.tasks, many=True).data)
-    self.assertEqual(rest_tag.tasks.count(), 1)
-    
-  
+    for name, count in (('django', 2), ('docs', 2), ('auth', 1), ('rest', 1)):
+      with self.subTest(tag=name):
+        response = self.c.get(f'/api/tagInfo/{name}/')
+
+        tag = Tag.objects.get(name=name)
+        self.assertEqual(
+          response.json()['results'],
+          TaskSerializer(tag.tasks.order_by('-id'), many=True).data)
+        self.assertEqual(response.json()['count'], count)
+        self.assertEqual(tag.tasks.count(), count)
+
+
+  def test_done_filter(self):
+    task = Task.objects.get(title=self.task_1['title'])
+    task.done = True
+    task.save()
+
+    done = self.c.get('/api/tagInfo/django/', {'done': 'true'})
+    pending = self.c.get('/api/tagInfo/django/', {'done': 'false'})
+
+    self.assertEqual([t['id'] for t in done.json()['results']], [task.id])
+    self.assertEqual(
+      [t['id'] for t in pending.json()['results']],
+      [Task.objects.get(title=self.task_2['title']).id])
+    # The total is the tag's
+    self.assertEqual(done.json()['count'], 2)
+
+
+  def test_cursor_pages(self):
+    first = self.c.get('/api/tagInfo/docs/', {'page_size': 1})
+    second = self.c.get(first.json()['next'])
+
+    tasks = Tag.objects.get(name='docs').tasks.order_by('-id')
+    self.assertEqual(first.json()['results'][0]['id'], tasks[0].id)
+    self.assertEqual(second.json()['results'][0]['id'], tasks[1].id)
+    self.assertIsNone(second.json()['next'])
+
+
+  @override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+  def test_queries_do_not_grow(self):
+    self.c.get('/api/tagInfo/django/')
+    with CaptureQueriesContext(connection) as small:
+      self.c.get('/api/tagInfo/django/')
+
+    user = User.objects.first()
+    tag = Tag.objects.get(name='django')
+    for i in range(30):
+      task = Task.objects.create(title=f'More {i}', estimated=1, user=user)
+      task.tags.add(tag, Tag.objects.get(name='docs'))
+      Subtask.objects.create(task=task, title='subtask')
+
+    self.c.get('/api/tagInfo/django/')
+    with CaptureQueriesContext(connection) as large:
+      response = self.c.get('/api/tagInfo/django/')
+
+    self.assertEqual(len(small), len(large))
+    self.assertEqual(response.json()['count'], 32)
+    # The cached total skips the COUNT(*)
+    self.assertFalse(any('COUNT(' in query['sql'] for query in large))
+
+
   def test_invalid_tag(self):
     invalid_tag = self.c.get('/api/tagInfo/angular/')
 
@@ -1319,3 +1377,2031 @@ class TagInfoTestCase(TestCase):
 
 
 
+class TokenRefreshMiddlewareTestCase(TestCase):
+  # User lookup only, the refresh token comes from its cookie
+  refresh_path_queries = 1
+  refresh_cookie = 'refresh_token'
+
+  def setUp(self):
+    # Keep the logged in client, it carries the refresh token
+    self.auth = AuthUtils()
+    self.auth.auth()
+    self.c = self.auth.c
+    self.user = User.objects.get(username='test_user')
+
+
+  def expired_access_token(self):
+    token = AccessToken.for_user(self.user)
+    token.set_exp(lifetime=-timedelta(seconds=1))
+    return str(token)
+
+
+  def count_view_calls(self, view):
+    return mock.patch.object(
+      view, 'dispatch', autospec=True, side_effect=view.dispatch)
+
+
+  def corrupt_refresh_token(self):
+    self.c.cookies[self.refresh_cookie] = 'not a token'
+
+
+  def test_missing_access_token_runs_view_once(self):
+    del self.c.cookies['access_token']
+
+    with self.count_view_calls(CurrentUserView) as view:
+      with self.assertNumQueries(self.refresh_path_queries):
+        response = self.c.get('/api/me/')
+
+    self.assertEqual(view.call_count, 1)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertTrue(response.cookies['access_token'].value)
+
+
+  def test_expired_access_token_runs_view_once(self):
+    self.c.cookies['access_token'] = self.expired_access_token()
+
+    with self.count_view_calls(CurrentUserView) as view:
+      with self.assertNumQueries(self.refresh_path_queries):
+        response = self.c.get('/api/me/')
+
+    self.assertEqual(view.call_count, 1)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertNotEqual(response.cookies['access_token'].value, self.auth.access_token)
+
+
+  def test_refresh_path_writes_once(self):
+    self.c.cookies['access_token'] = self.expired_access_token()
+
+    with self.count_view_calls(StatsViewSet) as view:
+      response = self.c.post('/api/stats/', {'day': '2022-11-11'})
+
+    self.assertEqual(view.call_count, 1)
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    self.assertEqual(Stats.objects.get(day='2022-11-11').chores_done, 1)
+
+
+  def test_valid_access_token_is_kept(self):
+    with self.count_view_calls(CurrentUserView) as view:
+      response = self.c.get('/api/me/')
+
+    self.assertEqual(view.call_count, 1)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertNotIn('access_token', response.cookies)
+
+
+  def test_invalid_refresh_token_logs_out(self):
+    self.corrupt_refresh_token()
+
+    with self.count_view_calls(CurrentUserView) as view:
+      response = self.c.get('/api/me/')
+
+    self.assertEqual(view.call_count, 1)
+    self.assertEqual(response.cookies['access_token'].value, '')
+    self.assertEqual(response.cookies[self.refresh_cookie].value, '')
+
+
+  def test_logout_clears_refresh_token(self):
+    response = self.c.post('/api/auth/logout/')
+
+    self.assertEqual(response.json(), {'message': 'You are logged out'})
+    self.assertEqual(response.cookies[self.refresh_cookie].value, '')
+
+
+
+@override_settings(REFRESH_TOKEN_STORAGE={'MODE': 'session'})
+class SessionTokenRefreshMiddlewareTestCase(TokenRefreshMiddlewareTestCase):
+  # Session and user lookups
+  refresh_path_queries = 2
+  refresh_cookie = 'sessionid'
+
+  def corrupt_refresh_token(self):
+    session = self.c.session
+    session['refresh'] = 'not a token'
+    session.save()
+
+
+
+class RefreshTokenCookieTestCase(TestCase):
+  def setUp(self):
+    self.auth = AuthUtils()
+    self.auth.register()
+
+
+  def test_login_sets_scoped_refresh_cookie(self):
+    response = self.auth.login()
+    cookie = response.cookies['refresh_token']
+
+    self.assertEqual(cookie['path'], '/api/')
+    self.assertTrue(cookie['httponly'])
+    self.assertNotIn('sessionid', response.cookies)
+
+
+  def test_requests_skip_the_session_table(self):
+    self.auth.login()
+
+    with CaptureQueriesContext(connection) as queries:
+      self.auth.c.get('/api/me/')
+
+    self.assertFalse([q for q in queries if 'django_session' in q['sql']])
+
+
+
+class AuthTokenCacheTestCase(TestCase):
+  def setUp(self):
+    token_cache.clear()
+    auth = AuthUtils()
+    auth.auth()
+    self.access_token = auth.access_token.value
+    self.c = Client()
+    self.c.cookies['access_token'] = self.access_token
+
+
+  def test_cached_token_skips_user_query(self):
+    with self.assertNumQueries(1):
+      self.c.get('/api/me/')
+
+    with self.assertNumQueries(0):
+      response = self.c.get('/api/me/')
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json()['username'], 'test_user')
+
+
+  def test_user_change_invalidates_cache(self):
+    self.c.get('/api/me/')
+
+    user = User.objects.get(username='test_user')
+    user.auto_start_pomos = True
+    user.save()
+
+    with self.assertNumQueries(1):
+      response = self.c.get('/api/me/')
+
+    self.assertTrue(response.json()['auto_start_pomos'])
+
+
+  def test_tampered_token_is_rejected(self):
+    self.c.get('/api/me/')
+
+    # Same claims, and so the same jti, with another signature
+    claims = jwt.decode(self.access_token, options={'verify_signature': False})
+    self.c.cookies['access_token'] = jwt.encode(claims, 'not the secret key', algorithm='HS256')
+
+    response = self.c.get('/api/me/')
+
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+  @override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+  def test_disabled_cache(self):
+    self.c.get('/api/me/')
+
+    with self.assertNumQueries(1):
+      self.c.get('/api/me/')
+
+    self.assertEqual(len(token_cache.entries), 0)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class ClaimsAuthenticationTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.task = Task.objects.create(user=self.user, title='Claims', estimated=1)
+
+
+  def test_current_task_without_user_query(self):
+    with self.assertNumQueries(0):
+      response = self.c.get('/api/currentTask/')
+
+    self.assertEqual(response.json(), {'id': 0})
+
+
+  def test_claims_follow_changes(self):
+    response = self.c.put('/api/currentTask/', {
+      'id': self.task.id
+    }, content_type='application/json')
+
+    self.assertIn('access_token', response.cookies)
+
+    with self.assertNumQueries(0):
+      response = self.c.get('/api/currentTask/')
+
+    self.assertEqual(response.json(), {'id': self.task.id})
+
+
+  def test_other_devices_see_changes(self):
+    other_device = Client()
+    other_device.cookies['access_token'] = str(access_token_for(self.user))
+    other_device.put('/api/currentTask/', {'id': self.task.id}, content_type='application/json')
+
+    # The claims of this device's token are stale, the user is loaded
+    with self.assertNumQueries(1):
+      response = self.c.get('/api/currentTask/')
+
+    self.assertEqual(response.json(), {'id': self.task.id})
+
+
+  def test_inactive_user_is_refused(self):
+    self.user.is_active = False
+    self.user.save()
+
+    response = self.c.get('/api/currentTask/')
+
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+  def test_claims_outlive_the_cached_version(self):
+    later = time.time() + token_cache_settings()['TTL'] + 1
+
+    # The version is read again, the token's claims are still current
+    with mock.patch('api.cache.time.time', return_value=later):
+      with self.assertNumQueries(1):
+        self.c.get('/api/currentTask/')
+      with self.assertNumQueries(0):
+        response = self.c.get('/api/currentTask/')
+
+    self.assertEqual(response.json(), {'id': 0})
+
+
+  def test_claims_follow_settings_changes(self):
+    self.c.patch(f'/api/users/{self.user.id}/', {
+      'auto_start_pomos': True
+    }, content_type='application/json')
+
+    claims = AccessToken(self.c.cookies['access_token'].value)
+
+    self.assertTrue(claims['auto_start_pomos'])
+
+
+  def test_user_scoped_lists_only_query_rows(self):
+    Tag.objects.create(name='claims', user=self.user)
+
+    with self.assertNumQueries(1):
+      response = self.c.get('/api/tags/')
+
+    self.assertEqual(response.json(), TagSerializer(self.user.tags.all(), many=True).data)
+
+
+  def test_token_without_claims_loads_user(self):
+    self.c.cookies['access_token'] = str(AccessToken.for_user(self.user))
+
+    with self.assertNumQueries(1):
+      response = self.c.get('/api/currentTask/')
+
+    self.assertEqual(response.json(), {'id': 0})
+
+
+
+class TokenRevocationTestCase(TestCase):
+  def setUp(self):
+    self.auth = AuthUtils()
+    self.auth.auth()
+    self.access_token = self.auth.access_token.value
+    self.refresh_token = self.auth.c.cookies['refresh_token'].value
+
+
+  def stolen_client(self, **cookies):
+    c = Client()
+    for name, value in cookies.items():
+      c.cookies[name] = value
+    return c
+
+
+  def test_logout_revokes_access_token(self):
+    c = self.stolen_client(access_token=self.access_token)
+    self.assertEqual(c.get('/api/me/').status_code, status.HTTP_200_OK)
+
+    self.auth.c.post('/api/auth/logout/')
+
+    self.assertEqual(c.get('/api/me/').status_code, status.HTTP_401_UNAUTHORIZED)
+    self.assertEqual(RevokedToken.objects.count(), 2)
+
+
+  def test_logout_revokes_refresh_token(self):
+    self.auth.c.post('/api/auth/logout/')
+
+    c = self.stolen_client(refresh_token=self.refresh_token)
+    response = c.get('/api/me/')
+
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    self.assertEqual(response.cookies['refresh_token'].value, '')
+
+
+  def test_valid_token_skips_the_table(self):
+    self.auth.c.get('/api/me/')
+
+    with CaptureQueriesContext(connection) as queries:
+      self.auth.c.get('/api/me/')
+
+    self.assertFalse([q for q in queries if 'api_revokedtoken' in q['sql']])
+
+
+  def test_expired_entries_are_left_out(self):
+    RevokedToken.objects.create(jti='expired', expires_at=timezone.now() - timedelta(seconds=1))
+    RevokedToken.objects.create(jti='valid', expires_at=timezone.now() + timedelta(days=1))
+
+    # The requests only read the table
+    with CaptureQueriesContext(connection) as queries:
+      revoked_tokens.sync()
+    self.assertEqual([q['sql'] for q in queries if not q['sql'].startswith('SELECT')], [])
+
+    self.assertFalse(revoked_tokens.is_revoked('expired'))
+    self.assertTrue(revoked_tokens.is_revoked('valid'))
+
+
+  def test_expired_entries_are_compacted_at_logout(self):
+    RevokedToken.objects.create(jti='expired', expires_at=timezone.now() - timedelta(seconds=1))
+
+    self.auth.c.post('/api/auth/logout/')
+
+    self.assertFalse(RevokedToken.objects.filter(jti='expired').exists())
+    self.assertEqual(RevokedToken.objects.count(), 2)
+
+
+  def test_waiting_threads_do_not_rebuild_again(self):
+    rebuilds = []
+
+    def rebuild():
+      rebuilds.append(threading.current_thread())
+      time.sleep(0.05)
+      revoked_tokens._filter = BloomFilter(bits=1024, hashes=3)
+      revoked_tokens._synced_at = time.monotonic()
+
+    revoked_tokens._filter = None
+    with mock.patch.object(revoked_tokens, '_rebuild', side_effect=rebuild):
+      threads = [
+        threading.Thread(target=revoked_tokens.is_revoked, args=('jti',)) for _ in range(4)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+    self.assertEqual(len(rebuilds), 1)
+    revoked_tokens.sync()
+
+
+  def test_other_workers_revocations_are_picked_up(self):
+    revoked_tokens.sync()
+    # Revoked by another process, this one's filter does not have it
+    RevokedToken.objects.create(jti='elsewhere', expires_at=timezone.now() + timedelta(days=1))
+    self.assertFalse(revoked_tokens.is_revoked('elsewhere'))
+
+    with mock.patch('api.revocation.time.monotonic', return_value=time.monotonic() + 5):
+      self.assertTrue(revoked_tokens.is_revoked('elsewhere'))
+
+
+  def test_bloom_filter(self):
+    bloom = BloomFilter(bits=1024, hashes=3)
+    bloom.add('revoked')
+
+    self.assertIn('revoked', bloom)
+    self.assertNotIn('not revoked', bloom)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class TaskQueryCountTestCase(TestCase):
+  # user, count, tasks, tags, subtasks, projects, project tasks
+  list_queries = 7
+  # user, task, tags, subtasks, projects, project tasks
+  retrieve_queries = 6
+
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.project = Project.objects.create(name='Queries', user=self.user)
+    self.tags = [Tag.objects.create(name=f'tag_{i}', user=self.user) for i in range(3)]
+
+
+  def create_tasks(self, amount):
+    for i in range(amount):
+      task = Task.objects.create(title=f'Task {i}', estimated=1, user=self.user)
+      task.tags.add(*self.tags)
+      Subtask.objects.create(task=task, title='first')
+      Subtask.objects.create(task=task, title='second')
+      self.project.tasks.add(task)
+
+
+  def test_list_queries_do_not_grow(self):
+    created = 0
+
+    for amount in (1, 10, 100):
+      with self.subTest(tasks=amount):
+        self.create_tasks(amount - created)
+        created = amount
+
+        with self.assertNumQueries(self.list_queries):
+          response = self.c.get('/api/tasks/', {'page_size': amount})
+
+        results = response.json()['results']
+        tasks = Task.objects.filter(in_project=False).order_by('-id')[:len(results)]
+        self.assertEqual(results, TaskSerializer(tasks, many=True).data)
+
+
+  def test_retrieve_queries_do_not_grow(self):
+    self.create_tasks(1)
+    task = Task.objects.get()
+    task.tags.add(*[Tag.objects.create(name=f'more_{i}', user=self.user) for i in range(10)])
+
+    with self.assertNumQueries(self.retrieve_queries):
+      response = self.c.get(f'/api/tasks/{task.id}/')
+
+    self.assertEqual(response.json(), TaskSerializer(task).data)
+
+
+  def test_retrieve_other_users_task(self):
+    other = User.objects.create(username='other_user', password='other_password')
+    task = Task.objects.create(title='Not yours', estimated=1, user=other)
+
+    response = self.c.get(f'/api/tasks/{task.id}/')
+
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class ProjectQueryCountTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.tags = [Tag.objects.create(name=f'tag_{i}', user=self.user) for i in range(3)]
+
+
+  def create_projects(self, projects, tasks):
+    for i in range(projects):
+      project = Project.objects.create(name=f'Project {i}', user=self.user)
+
+      for j in range(tasks):
+        task = Task.objects.create(title=f'Task {j}', estimated=1, user=self.user, in_project=True)
+        task.tags.add(*self.tags)
+        Subtask.objects.create(task=task, title='subtask')
+        project.tasks.add(task)
+
+
+  def count_queries(self, url, params=None):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.get(url, params)
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return len(queries)
+
+
+  def test_list_queries_do_not_grow(self):
+    self.create_projects(projects=1, tasks=1)
+    small = self.count_queries('/api/projects/', {'page_size': 10})
+
+    self.create_projects(projects=9, tasks=25)
+    large = self.count_queries('/api/projects/', {'page_size': 10})
+
+    self.assertEqual(small, large)
+
+
+  def test_detail_queries_do_not_grow(self):
+    self.create_projects(projects=1, tasks=1)
+    small = self.count_queries(f'/api/projects/{Project.objects.get().id}/')
+
+    project = Project.objects.get()
+    for i in range(50):
+      task = Task.objects.create(title=f'More {i}', estimated=1, user=self.user, in_project=True)
+      task.tags.add(*self.tags)
+      project.tasks.add(task)
+    large = self.count_queries(f'/api/projects/{project.id}/')
+
+    self.assertEqual(small, large)
+
+
+  def test_list_payload_is_unchanged(self):
+    self.create_projects(projects=3, tasks=4)
+
+    response = self.c.get('/api/projects/', {'page_size': 10})
+
+    self.assertEqual(
+      response.json()['results'],
+      ProjectSerializer(Project.objects.order_by('-id'), many=True).data)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class SparseFieldsetTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.tag = Tag.objects.create(name='sparse', user=self.user)
+    self.project = Project.objects.create(name='Sparse', user=self.user)
+
+    for i in range(3):
+      task = Task.objects.create(title=f'Task {i}', description='long', estimated=1, user=self.user)
+      task.tags.add(self.tag)
+      Subtask.objects.create(task=task, title='subtask')
+      self.project.tasks.add(task)
+
+
+  def count_queries(self, url, params=None):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.get(url, params)
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return response.json(), queries
+
+
+  def test_task_fields(self):
+    data, queries = self.count_queries('/api/tasks/', {'fields': 'id,title'})
+
+    for task in data['results']:
+      self.assertEqual(set(task), {'id', 'title'})
+    # Unrequested relations are not fetched
+    self.assertFalse(any('api_subtask' in query['sql'] for query in queries))
+    self.assertFalse(any('description' in query['sql'] for query in queries))
+
+
+  def test_task_relations_as_ids(self):
+    data, _ = self.count_queries('/api/tasks/', {'fields': 'id,tags,subtasks', 'expand': ''})
+
+    task = data['results'][0]
+    self.assertEqual(task['tags'], [self.tag.id])
+    self.assertEqual(task['subtasks'], list(Task.objects.get(id=task['id']).subtasks.values_list('id', flat=True)))
+
+
+  def test_task_expand(self):
+    data, _ = self.count_queries('/api/tasks/', {'fields': 'id,tags,subtasks', 'expand': 'tags'})
+
+    task = data['results'][0]
+    # Expanded tags are rendered as in the default payload, depth=1
+    self.assertEqual(task['tags'], [{'id': self.tag.id, 'name': 'sparse', 'user': self.user.id}])
+    self.assertTrue(all(isinstance(subtask, int) for subtask in task['subtasks']))
+
+
+  def test_retrieve_fields(self):
+    task = Task.objects.first()
+
+    data, _ = self.count_queries(f'/api/tasks/{task.id}/', {'fields': 'title'})
+
+    self.assertEqual(data, {'title': task.title})
+
+
+  def test_project_nested_fields(self):
+    data, _ = self.count_queries('/api/projects/', {'fields': 'name,tasks.title'})
+
+    self.assertEqual(data['results'], [{
+      'name': 'Sparse',
+      'tasks': [{'title': task.title} for task in self.project.tasks.all()]}])
+
+
+  def test_project_tasks_as_ids(self):
+    data, _ = self.count_queries('/api/projects/', {'expand': ''})
+
+    self.assertEqual(
+      data['results'][0]['tasks'],
+      list(self.project.tasks.values_list('id', flat=True)))
+
+
+  def test_tag_info_fields(self):
+    data, _ = self.count_queries('/api/tagInfo/sparse/', {'fields': 'id,title'})
+
+    self.assertEqual(
+      data['results'],
+      [{'id': task.id, 'title': task.title} for task in self.tag.tasks.order_by('-id')])
+
+
+  def test_default_payload_is_unchanged(self):
+    data, _ = self.count_queries('/api/tasks/')
+
+    tasks = Task.objects.filter(in_project=False).order_by('-id')
+    self.assertEqual(data['results'], TaskSerializer(tasks, many=True).data)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class CursorPaginationTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    for counter in row_counters.values():
+      counter.clear()
+
+    self.user = User.objects.get(username='test_user')
+    self.tasks = [Task.objects.create(title=f'Task {i}', estimated=1, user=self.user) for i in range(10)]
+
+
+  def ids(self, response):
+    return [task['id'] for task in response.json()['results']]
+
+
+  def test_pages_follow_the_ids(self):
+    first = self.c.get('/api/tasks/', {'cursor': '', 'page_size': 4})
+    second = self.c.get(first.json()['next'])
+
+    expected = [task.id for task in reversed(self.tasks)]
+    self.assertEqual(self.ids(first), expected[:4])
+    self.assertEqual(self.ids(second), expected[4:8])
+    self.assertIsNone(first.json()['previous'])
+    self.assertNotIn('count', first.json())
+
+
+  def test_pages_are_stable_across_inserts_and_deletes(self):
+    first = self.c.get('/api/tasks/', {'cursor': '', 'page_size': 4})
+
+    Task.objects.create(title='New', estimated=1, user=self.user)
+    self.tasks[0].delete()
+    second = self.c.get(first.json()['next'])
+
+    expected = [task.id for task in reversed(self.tasks[1:])]
+    self.assertEqual(self.ids(second), expected[4:8])
+
+
+  def test_no_offset_scan_or_count(self):
+    first = self.c.get('/api/tasks/', {'cursor': '', 'page_size': 4})
+
+    with CaptureQueriesContext(connection) as queries:
+      self.c.get(first.json()['next'])
+
+    sql = ' '.join(query['sql'] for query in queries)
+    self.assertNotIn('COUNT(', sql)
+    self.assertNotIn('OFFSET', sql)
+
+
+  def test_cached_count(self):
+    response = self.c.get('/api/tasks/', {'cursor': '', 'count': 'true'})
+    self.assertEqual(response.json()['count'], 10)
+
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.get('/api/tasks/', {'cursor': '', 'count': 'true'})
+    self.assertEqual(response.json()['count'], 10)
+    self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    Task.objects.create(title='New', estimated=1, user=self.user)
+    response = self.c.get('/api/tasks/', {'cursor': '', 'count': 'true'})
+    self.assertEqual(response.json()['count'], 11)
+
+
+  def test_projects(self):
+    projects = [Project.objects.create(name=f'p{i}', user=self.user) for i in range(3)]
+
+    first = self.c.get('/api/projects/', {'cursor': '', 'count': '1'})
+    second = self.c.get(first.json()['next'])
+
+    self.assertEqual(first.json()['count'], 3)
+    self.assertEqual(self.ids(first) + self.ids(second), [p.id for p in reversed(projects)])
+
+
+  def test_page_numbers_are_the_default(self):
+    response = self.c.get('/api/tasks/')
+
+    self.assertEqual(response.json()['count'], 10)
+    self.assertEqual(len(response.json()['results']), 4)
+
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Reads the plans of SQLite')
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class QueryPlanTestCase(TestCase):
+  """
+  Runs EXPLAIN QUERY PLAN on the SQL of every user scoped
+  list endpoint, none of them should scan a whole table
+  """
+  endpoints = [
+    ('/api/tasks/', {}),
+    ('/api/tasks/', {'cursor': ''}),
+    ('/api/projects/', {}),
+    ('/api/stats/', {}),
+    ('/api/tags/', {}),
+    ('/api/modes/', {}),
+    ('/api/tagInfo/work/', {}),
+  ]
+
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    user = User.objects.get(username='test_user')
+    tag = Tag.objects.create(name='work', user=user)
+    project = Project.objects.create(name='Plans', user=user)
+    Stats.objects.create(user=user)
+    Mode.objects.create(name='Focus', user=user)
+
+    for i in range(3):
+      task = Task.objects.create(title=f'Task {i}', estimated=1, user=user)
+      task.tags.add(tag)
+      Subtask.objects.create(task=task, title='subtask')
+      project.tasks.add(task)
+
+
+  def full_scans(self, sql):
+    with connection.cursor() as cursor:
+      cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+      details = [row[-1] for row in cursor.fetchall()]
+
+    # SCAN <table> without an index reads every row
+    return [detail for detail in details
+            if detail.startswith('SCAN') and 'USING' not in detail]
+
+
+  def test_list_endpoints_use_indexes(self):
+    for url, params in self.endpoints:
+      with self.subTest(url=url, params=params):
+        with CaptureQueriesContext(connection) as queries:
+          response = self.c.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for query in queries:
+          if query['sql'].startswith('SELECT'):
+            self.assertEqual(self.full_scans(query['sql']), [], query['sql'])
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class TaskBulkCreateTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+
+
+  def create_task(self, tags, subtasks):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.post('/api/tasks/', {
+        'title': 'Bulk',
+        'estimated': 1,
+        'tags': [{'name': f'tag_{i}'} for i in range(tags)],
+        'subtasks': [{'title': f'subtask_{i}'} for i in range(subtasks)],
+      }, content_type='application/json')
+
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    return response, len(queries)
+
+
+  def test_queries_do_not_grow(self):
+    _, small = self.create_task(tags=1, subtasks=1)
+    Tag.objects.all().delete()
+    _, large = self.create_task(tags=10, subtasks=20)
+
+    self.assertEqual(small, large)
+
+
+  def test_existing_tags_are_reused(self):
+    existing = Tag.objects.create(name='tag_0', user=self.user)
+
+    response, _ = self.create_task(tags=3, subtasks=2)
+
+    task = Task.objects.get(id=response.json()['id'])
+    self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+    self.assertIn(existing, task.tags.all())
+    self.assertEqual(task.subtasks.count(), 2)
+    self.assertEqual(response.json(), TaskSerializer(task).data)
+
+
+  def test_duplicate_tags(self):
+    response = self.c.post('/api/tasks/', {
+      'title': 'Duplicates',
+      'estimated': 1,
+      'tags': [{'name': 'same'}, {'name': 'same'}],
+    }, content_type='application/json')
+
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    self.assertEqual(len(response.json()['tags']), 1)
+
+
+  def test_failed_subtask_rolls_back(self):
+    with self.assertRaises(TypeError):
+      self.c.post('/api/tasks/', {
+        'title': 'Broken',
+        'estimated': 1,
+        'tags': [{'name': 'rolled_back'}],
+        'subtasks': [{'title': 'ok'}, {'unknown_field': 'nope'}],
+      }, content_type='application/json')
+
+    self.assertFalse(Task.objects.filter(title='Broken').exists())
+    self.assertFalse(Tag.objects.filter(name='rolled_back').exists())
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class ProjectBulkCreateTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+
+
+  def create_project(self, tasks):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.post('/api/projects/', {'name': 'Template', 'tasks': tasks},
+                             content_type='application/json')
+    return response, len(queries)
+
+
+  def template(self, amount):
+    return [{
+      'title': f'Task {i}',
+      'estimated': 1,
+      'tags': [{'name': 'template'}, {'name': f'tag_{i % 5}'}],
+    } for i in range(amount)]
+
+
+  def test_queries_do_not_grow(self):
+    _, small = self.create_project(self.template(2))
+    Tag.objects.all().delete()
+    response, large = self.create_project(self.template(100))
+
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    self.assertEqual(small, large)
+
+
+  def test_tasks_tags_and_projects(self):
+    Tag.objects.create(name='template', user=self.user)
+    other = User.objects.create(username='other_user', password='other_password')
+    Tag.objects.create(name='tag_0', user=other)
+
+    response, _ = self.create_project(self.template(6))
+
+    project = Project.objects.get(id=response.json()['id'])
+    self.assertEqual(response.json(), ProjectSerializer(project).data)
+    self.assertEqual(project.tasks.filter(in_project=True, user=self.user).count(), 6)
+    self.assertEqual(Tag.objects.get(name='template', user=self.user).tasks.count(), 6)
+    # Tags are scoped to the user
+    self.assertEqual(Tag.objects.get(name='tag_0', user=self.user).tasks.count(), 2)
+    self.assertEqual(Tag.objects.get(name='tag_0', user=other).tasks.count(), 0)
+
+
+  def test_invalid_tasks_are_reported_without_writes(self):
+    tasks = self.template(3)
+    tasks[1]['estimated'] = 'not a number'
+
+    response, _ = self.create_project(tasks)
+
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    errors = response.json()['tasks']
+    self.assertEqual(errors[0], {})
+    self.assertIn('estimated', errors[1])
+    self.assertFalse(Project.objects.exists())
+    self.assertFalse(Task.objects.exists())
+    self.assertFalse(Tag.objects.exists())
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class TaskBatchTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.task = Task.objects.create(title='Batched', estimated=1, user=self.user)
+    self.tag = Tag.objects.create(name='old', user=self.user)
+    self.task.tags.add(self.tag)
+    self.subtask = Subtask.objects.create(task=self.task, title='first')
+
+
+  def batch(self, operations, task=None):
+    return self.c.post(f'/api/tasks/{(task or self.task).id}/batch/',
+                       {'operations': operations}, content_type='application/json')
+
+
+  def test_operations_are_applied_in_order(self):
+    response = self.batch([
+      {'obj': 'tag', 'action': 'add', 'tag_name': 'new'},
+      {'obj': 'tag', 'action': 'remove', 'tag_id': self.tag.id},
+      {'obj': 'subtask', 'action': 'add', 'subtask': {'title': 'second'}},
+      {'obj': 'subtask', 'action': 'update', 'subtask': {'id': self.subtask.id, 'title': 'renamed'}},
+      {'obj': 'subtask', 'action': 'done', 'subtask_id': self.subtask.id},
+      {'obj': 'task', 'action': 'done'},
+      {'obj': 'task', 'action': 'increment_gone_through'},
+    ])
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(
+      [result['status'] for result in response.json()['results']],
+      [201, 200, 201, 200, 200, 200, 200])
+
+    self.task.refresh_from_db()
+    self.subtask.refresh_from_db()
+    self.assertEqual([tag.name for tag in self.task.tags.all()], ['new'])
+    self.assertEqual(self.task.subtasks.count(), 2)
+    self.assertEqual(self.subtask.title, 'renamed')
+    self.assertTrue(self.subtask.done)
+    self.assertTrue(self.task.done)
+    self.assertEqual(self.task.gone_through, 1)
+
+
+  def test_queries_are_shared(self):
+    def count(operations):
+      with CaptureQueriesContext(connection) as queries:
+        self.batch(operations)
+      return len(queries)
+
+    done = {'obj': 'subtask', 'action': 'done', 'subtask_id': self.subtask.id}
+    # Every toggle costs its UPDATE only
+    self.assertEqual(count([done] * 10) - count([done]), 9)
+
+
+  def test_failure_rolls_back_the_batch(self):
+    logged = Change.objects.count()
+    response = self.batch([
+      {'obj': 'subtask', 'action': 'done', 'subtask_id': self.subtask.id},
+      {'obj': 'tag', 'action': 'add', 'tag_name': 'old'},
+      {'obj': 'task', 'action': 'done'},
+    ])
+
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(
+      [result['status'] for result in response.json()['results']], [200, 400])
+    self.subtask.refresh_from_db()
+    self.assertFalse(self.subtask.done)
+    self.assertEqual(Change.objects.count(), logged)
+
+
+  def test_unknown_operation(self):
+    response = self.batch([{'obj': 'task', 'action': 'explode'}])
+
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+  def test_malformed_operations(self):
+    operations = [
+      1,
+      {'obj': 'subtask', 'action': 'add', 'subtask': 'x'},
+      {'obj': 'subtask', 'action': 'add', 'subtask': {'description': 'no title'}},
+      {'obj': 'subtask', 'action': 'update', 'subtask': 'x'},
+    ]
+    for operation in operations:
+      with self.subTest(operation=operation):
+        response = self.batch([operation])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['results'][0]['status'], 400)
+
+
+  def test_unknown_subtask_fields_are_ignored(self):
+    response = self.batch([
+      {'obj': 'subtask', 'action': 'add', 'subtask': {'title': 'second', 'task': 0, 'color': 'red'}},
+    ])
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(self.task.subtasks.count(), 2)
+
+
+  def test_ids_which_are_not_ints(self):
+    response = self.batch([{'obj': 'subtask', 'action': 'done', 'subtask_id': [self.subtask.id]}])
+
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(response.json()['results'][0]['status'], 404)
+
+
+  def test_other_users_task(self):
+    other = User.objects.create(username='other_user', password='other_password')
+    task = Task.objects.create(title='Not yours', estimated=1, user=other)
+
+    response = self.batch([{'obj': 'task', 'action': 'done'}], task=task)
+
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class ProjectDeletionTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.tags = [Tag.objects.create(name=f'tag_{i}', user=self.user) for i in range(3)]
+
+
+  def create_project(self, tasks):
+    project = Project.objects.create(name='Doomed', user=self.user)
+
+    for i in range(tasks):
+      task = Task.objects.create(title=f'Task {i}', estimated=1, user=self.user, in_project=True)
+      task.tags.add(*self.tags)
+      Subtask.objects.create(task=task, title='subtask')
+      project.tasks.add(task)
+
+    return project
+
+
+  def delete(self, project):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.delete(f'/api/projects/{project.id}/')
+
+    self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    return len(queries)
+
+
+  def test_statements_do_not_grow(self):
+    small = self.delete(self.create_project(1))
+    large = self.delete(self.create_project(100))
+
+    self.assertEqual(small, large)
+    self.assertFalse(Task.objects.exists())
+    self.assertFalse(Subtask.objects.exists())
+    self.assertFalse(Task.tags.through.objects.exists())
+    self.assertFalse(Project.tasks.through.objects.exists())
+
+
+  def test_outside_tasks_are_kept(self):
+    project = self.create_project(2)
+    outside = Task.objects.create(title='Outside', estimated=1, user=self.user)
+    project.tasks.add(outside)
+
+    self.delete(project)
+
+    self.assertEqual(list(Task.objects.all()), [outside])
+    self.assertEqual(list(outside.tags.all()), [])
+
+
+  def test_current_task_is_reset(self):
+    project = self.create_project(2)
+    self.user.current_task_id = project.tasks.first().id
+    self.user.save()
+
+    response = self.c.delete(f'/api/projects/{project.id}/')
+
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_task_id, 0)
+    self.assertTrue(response.cookies['access_token'].value)
+
+
+  def test_delete_task(self):
+    project = self.create_project(2)
+    task = project.tasks.first()
+    self.user.current_task_id = task.id
+    self.user.save()
+
+    response = self.c.patch(f'/api/projects/{project.id}/delete_task/', {'task_id': task.id},
+                            content_type='application/json')
+
+    self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    self.assertFalse(Task.objects.filter(id=task.id).exists())
+    self.assertEqual(project.tasks.count(), 1)
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_task_id, 0)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class BulkTaskOperationsTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.tasks = [Task.objects.create(title=f'Task {i}', estimated=1, user=self.user) for i in range(5)]
+    self.ids = [task.id for task in self.tasks]
+    self.project = Project.objects.create(name='Target', user=self.user)
+
+    other = User.objects.create(username='other_user', password='other_password')
+    self.other_task = Task.objects.create(title='Not yours', estimated=1, user=other)
+
+
+  def bulk(self, endpoint, body):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.post(f'/api/tasks/{endpoint}/', body, content_type='application/json')
+    return response, queries
+
+
+  def writes(self, queries):
+    # The change log gets its own single INSERT, see log_writes
+    return [query['sql'] for query in queries
+            if query['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))
+            and '"api_change"' not in query['sql']]
+
+
+  def log_writes(self, queries):
+    return [query['sql'] for query in queries
+            if query['sql'].startswith('INSERT INTO "api_change"')]
+
+
+  def test_bulk_done(self):
+    response, queries = self.bulk('bulk_done', {'ids': self.ids + [self.other_task.id]})
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(sorted(response.json()['ids']), self.ids)
+    self.assertEqual(len(self.writes(queries)), 1)
+    self.assertEqual(len(self.log_writes(queries)), 1)
+    self.assertEqual(Task.objects.filter(user=self.user, done=True).count(), 5)
+    self.other_task.refresh_from_db()
+    self.assertFalse(self.other_task.done)
+
+    response, _ = self.bulk('bulk_done', {'ids': self.ids[:2], 'done': False})
+    self.assertEqual(sorted(response.json()['ids']), self.ids[:2])
+    self.assertEqual(Task.objects.filter(user=self.user, done=True).count(), 3)
+
+
+  def test_bulk_delete(self):
+    self.user.current_task_id = self.ids[0]
+    self.user.save()
+
+    response, _ = self.bulk('bulk_delete', {'ids': self.ids[:3] + [self.other_task.id]})
+
+    self.assertEqual(sorted(response.json()['ids']), self.ids[:3])
+    self.assertEqual(list(Task.objects.filter(user=self.user).order_by('id')), self.tasks[3:])
+    self.assertTrue(Task.objects.filter(id=self.other_task.id).exists())
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_task_id, 0)
+
+
+  def test_bulk_add_to_project(self):
+    self.project.tasks.add(self.tasks[0])
+
+    response, queries = self.bulk('bulk_add_to_project', {
+      'ids': self.ids + [self.other_task.id], 'project_id': self.project.id})
+
+    self.assertEqual(sorted(response.json()['ids']), self.ids[1:])
+    self.assertEqual(len(self.writes(queries)), 1)
+    self.assertEqual(len(self.log_writes(queries)), 1)
+    self.assertEqual(sorted(self.project.tasks.values_list('id', flat=True)), self.ids)
+
+
+  def test_bulk_remove_from_project(self):
+    inside = Task.objects.create(title='Inside', estimated=1, user=self.user, in_project=True)
+    self.project.tasks.add(*self.tasks, inside)
+
+    response, queries = self.bulk('bulk_remove_from_project', {
+      'ids': self.ids[:2] + [inside.id], 'project_id': self.project.id})
+
+    self.assertEqual(sorted(response.json()['ids']), self.ids[:2])
+    self.assertEqual(len(self.writes(queries)), 1)
+    self.assertEqual(len(self.log_writes(queries)), 1)
+    self.assertEqual(
+      sorted(self.project.tasks.values_list('id', flat=True)), self.ids[2:] + [inside.id])
+
+
+  def test_other_users_project(self):
+    other_project = Project.objects.create(name='Not yours', user=self.other_task.user)
+
+    response, _ = self.bulk('bulk_add_to_project', {'ids': self.ids, 'project_id': other_project.id})
+
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    self.assertFalse(other_project.tasks.exists())
+
+
+  def test_invalid_body(self):
+    response, _ = self.bulk('bulk_done', {'ids': []})
+
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+  def test_missing_project_id(self):
+    for endpoint in ('bulk_add_to_project', 'bulk_remove_from_project'):
+      with self.subTest(endpoint=endpoint):
+        response, _ = self.bulk(endpoint, {'ids': self.ids})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('project_id', response.json())
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class QueryBudgetTestCase(TestCase):
+  """
+  Every endpoint has a budget of queries it may run,
+  savepoints left aside as they are not sent outside tests
+  """
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+    revoked_tokens.sync()
+
+    self.user = User.objects.get(username='test_user')
+    self.tag = Tag.objects.create(name='work', user=self.user)
+    self.mode = Mode.objects.create(name='Focus', user=self.user)
+    self.project = Project.objects.create(name='Budget', user=self.user)
+    Stats.objects.create(user=self.user)
+
+    self.tasks = []
+    for i in range(4):
+      task = Task.objects.create(title=f'Task {i}', estimated=1, user=self.user, in_project=i >= 2)
+      task.tags.add(self.tag)
+      Subtask.objects.create(task=task, title='subtask')
+      if task.in_project:
+        self.project.tasks.add(task)
+      self.tasks.append(task)
+
+    self.user.current_mode_id = self.mode.id
+    self.user.current_task_id = self.tasks[0].id
+    self.user.save()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+
+  def endpoints(self):
+    task, other_task, project_task = self.tasks[0], self.tasks[1], self.tasks[2]
+    subtask = task.subtasks.first()
+
+    # method, url, body, budget
+    return [
+      ('get', '/api/tasks/', None, 7),
+      ('get', f'/api/tasks/{task.id}/', None, 6),
+      ('get', '/api/projects/', None, 8),
+      ('get', f'/api/projects/{self.project.id}/', None, 7),
+      ('get', '/api/tags/', None, 1),
+      ('get', '/api/modes/', None, 1),
+      ('get', '/api/stats/', None, 1),
+      ('get', '/api/me/', None, 1),
+      ('get', '/api/currentTask/', None, 0),
+      ('get', '/api/currentMode/', None, 1),
+      ('get', '/api/tagInfo/work/', None, 8),
+      ('patch', f'/api/tasks/{task.id}/', {'obj': 'task', 'action': 'done'}, 4),
+      ('patch', f'/api/tasks/{task.id}/', {'obj': 'subtask', 'action': 'done', 'subtask_id': subtask.id}, 4),
+      ('patch', f'/api/projects/{self.project.id}/task_done/', {'task_id': project_task.id}, 4),
+      ('delete', f'/api/tasks/{other_task.id}/', None, 9),
+    ]
+
+
+  def test_endpoints_stay_within_budget(self):
+    for method, url, body, budget in self.endpoints():
+      with self.subTest(method=method, url=url, body=body):
+        with CaptureQueriesContext(connection) as queries:
+          if body is None:
+            response = getattr(self.c, method)(url)
+          else:
+            response = getattr(self.c, method)(url, body, content_type='application/json')
+
+        self.assertLess(response.status_code, 400)
+        sql = [query['sql'] for query in queries
+               if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        self.assertLessEqual(len(sql), budget, sql)
+
+
+  def test_other_users_rows_are_not_found(self):
+    other = User.objects.create(username='other_user', password='other_password')
+    self.c.cookies['access_token'] = str(access_token_for(other))
+    task = self.tasks[0]
+
+    for method, url, body in [
+      ('patch', f'/api/tasks/{task.id}/', {'obj': 'task', 'action': 'done'}),
+      ('patch', f'/api/tasks/{task.id}/', {'obj': 'subtask', 'action': 'done', 'subtask_id': task.subtasks.first().id}),
+      ('patch', f'/api/projects/{self.project.id}/modify_title/', {'name': 'Stolen'}),
+      ('delete', f'/api/tasks/{task.id}/', None),
+      ('get', f'/api/tagInfo/work/', None),
+    ]:
+      with self.subTest(method=method, url=url):
+        if body is None:
+          response = getattr(self.c, method)(url)
+        else:
+          response = getattr(self.c, method)(url, body, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    task.refresh_from_db()
+    self.assertFalse(task.done)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class UserStateTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    revoked_tokens.sync()
+
+    self.user = User.objects.get(username='test_user')
+    self.task = Task.objects.create(title='Current', estimated=1, user=self.user)
+    self.mode = Mode.objects.create(name='Focus', user=self.user)
+
+    self.c = Client()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+    other = User.objects.create(username='other_user', password='other_password')
+    self.other_task = Task.objects.create(title='Not yours', estimated=1, user=other)
+    self.other_mode = Mode.objects.create(name='Not yours', user=other)
+
+
+  def request(self, method, url, body=None):
+    with CaptureQueriesContext(connection) as queries:
+      response = getattr(self.c, method)(url, body, content_type='application/json')
+    sql = [query['sql'] for query in queries
+           if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+    return response, sql
+
+
+  def test_set_current_task(self):
+    response, sql = self.request('put', '/api/currentTask/', {'id': self.task.id})
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json(), {'id': self.task.id})
+    # The UPDATE, then the change log's INSERT
+    self.assertEqual(len(sql), 2)
+    self.assertIn('"current_task_id"', sql[0])
+    self.assertNotIn('"username"', sql[0])
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_task_id, self.task.id)
+
+    # The new access token carries the new claims
+    self.c.cookies['access_token'] = response.cookies['access_token'].value
+    self.assertEqual(self.c.get('/api/currentTask/').json(), {'id': self.task.id})
+
+
+  @override_settings(AUTH_TOKEN_CACHE={'ENABLED': True})
+  def test_other_devices_see_the_current_task(self):
+    token_cache.clear()
+    other_device = Client()
+    other_device.cookies['access_token'] = str(access_token_for(self.user))
+    self.assertEqual(other_device.get('/api/me/').json()['current_task_id'], 0)
+
+    self.request('put', '/api/currentTask/', {'id': self.task.id})
+
+    self.assertEqual(other_device.get('/api/me/').json()['current_task_id'], self.task.id)
+
+
+  def test_deleting_the_current_task_set_elsewhere(self):
+    # Set from another device, this token still claims no current task
+    User.objects.filter(id=self.user.id).update(current_task_id=self.task.id)
+
+    response, _ = self.request('delete', f'/api/tasks/{self.task.id}/')
+
+    self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_task_id, 0)
+
+
+  def test_set_other_users_task(self):
+    response, sql = self.request('put', '/api/currentTask/', {'id': self.other_task.id})
+
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    self.assertEqual(len(sql), 1)
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_task_id, 0)
+
+
+  def test_set_current_mode(self):
+    response, sql = self.request('post', '/api/currentMode/', {'mode_id': self.mode.id})
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json(), ModesSerializer(self.mode).data)
+    self.assertEqual(len(sql), 3)
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_mode_id, self.mode.id)
+
+
+  def test_set_other_users_mode(self):
+    response, _ = self.request('post', '/api/currentMode/', {'mode_id': self.other_mode.id})
+
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_mode_id, 0)
+
+
+  def test_delete_current_mode(self):
+    self.user.current_mode_id = self.mode.id
+    self.user.save()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+    response, sql = self.request('delete', f'/api/modes/{self.mode.id}/')
+
+    self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    # The mode is loaded to send post_delete, then deleted, then the
+    # user is updated and both changes are logged at once
+    self.assertEqual(len(sql), 4)
+    self.assertTrue(response.cookies['access_token'].value)
+    self.assertFalse(Mode.objects.filter(id=self.mode.id).exists())
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_mode_id, 0)
+
+
+  def test_delete_other_mode(self):
+    other_mode = Mode.objects.create(name='Other', user=self.user)
+
+    response, _ = self.request('delete', f'/api/modes/{other_mode.id}/')
+
+    self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+    self.assertNotIn('access_token', response.cookies)
+
+
+  @override_settings(AUTH_TOKEN_CACHE={'ENABLED': True})
+  def test_cached_user_is_refreshed(self):
+    token_cache.clear()
+    self.c.get('/api/me/')
+
+    self.request('put', '/api/currentTask/', {'id': self.task.id})
+
+    self.assertEqual(self.c.get('/api/me/').json()['current_task_id'], self.task.id)
+
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class DefaultModeTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    revoked_tokens.sync()
+    user_cache.clear()
+
+    self.user = User.objects.get(username='test_user')
+    self.mode = Mode.objects.create(name='Focus', pomo=50, user=self.user)
+
+    self.c = Client()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+
+  def use_mode(self, mode_id):
+    self.user.current_mode_id = mode_id
+    self.user.save()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+
+  def test_default_mode_without_queries(self):
+    with self.assertNumQueries(0):
+      response = self.c.get('/api/currentMode/')
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json(), {
+      'id': 0, 'name': 'Default', 'pomo': 25, 'short_break': 5, 'long_break': 15})
+
+
+  def test_user_mode_is_cached(self):
+    self.use_mode(self.mode.id)
+
+    self.c.get('/api/currentMode/')
+    with self.assertNumQueries(0):
+      response = self.c.get('/api/currentMode/')
+
+    self.assertEqual(response.json(), ModesSerializer(self.mode).data)
+
+
+  def test_changed_mode_is_served(self):
+    self.use_mode(self.mode.id)
+    self.c.get('/api/currentMode/')
+
+    self.mode.pomo = 45
+    self.mode.save()
+
+    self.assertEqual(self.c.get('/api/currentMode/').json()['pomo'], 45)
+
+
+  def test_deleted_mode_falls_back_to_default(self):
+    self.use_mode(self.mode.id)
+    Mode.objects.filter(id=self.mode.id).delete()
+
+    response = self.c.get('/api/currentMode/')
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json()['name'], 'Default')
+
+
+  def test_back_to_default(self):
+    self.use_mode(self.mode.id)
+
+    response = self.c.post('/api/currentMode/', {'mode_id': 0}, content_type='application/json')
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.json()['id'], 0)
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.current_mode_id, 0)
+
+
+
+
+# A cache every worker would see, the shared
+# backend refuses the default LocMemCache
+SHARED_CACHE = {
+  'CACHES': {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {
+      'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+      'LOCATION': os.path.join(tempfile.gettempdir(), 'pomodo-test-user-cache'),
+    },
+  },
+  'USER_CACHE': {'BACKEND': 'shared', 'CACHE': 'shared'},
+}
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': False})
+class UserCacheTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    revoked_tokens.sync()
+    user_cache.clear()
+
+    self.user = User.objects.get(username='test_user')
+    self.tag = Tag.objects.create(name='work', user=self.user)
+    self.mode = Mode.objects.create(name='Focus', user=self.user)
+
+    self.c = Client()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+
+  def test_lists_are_read_once(self):
+    for url in ('/api/tags/', '/api/modes/'):
+      with self.subTest(url=url):
+        first = self.c.get(url)
+        with self.assertNumQueries(0):
+          second = self.c.get(url)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.json(), second.json())
+
+    self.assertEqual(user_cache.stats(), {
+      'modes': {'hits': 1, 'misses': 1},
+      'tags': {'hits': 1, 'misses': 1},
+    })
+
+
+  def test_writes_are_seen(self):
+    self.c.get('/api/tags/')
+    self.c.get('/api/modes/')
+
+    Tag.objects.create(name='home', user=self.user)
+    self.mode.name = 'Deep work'
+    self.mode.save()
+
+    self.assertEqual(
+      [tag['name'] for tag in self.c.get('/api/tags/').json()], ['work', 'home'])
+    self.assertEqual(self.c.get('/api/modes/').json()[0]['name'], 'Deep work')
+
+
+  def test_tags_created_with_a_task_are_seen(self):
+    self.c.get('/api/tags/')
+
+    self.c.post('/api/tasks/', {
+      'title': 'Task', 'estimated': 1, 'tags': [{'name': 'new'}], 'subtasks': [],
+    }, content_type='application/json')
+
+    self.assertIn('new', [tag['name'] for tag in self.c.get('/api/tags/').json()])
+
+
+  def test_me_is_refreshed(self):
+    self.c.get('/api/me/')
+
+    self.c.put('/api/currentTask/', {'id': 0}, content_type='application/json')
+    self.user.email = 'test@example.com'
+    self.user.save()
+
+    self.assertEqual(self.c.get('/api/me/').json()['email'], 'test@example.com')
+
+
+  def test_lists_are_not_shared_between_users(self):
+    self.c.get('/api/tags/')
+    other = User.objects.create(username='other_user', password='other_password')
+    self.c.cookies['access_token'] = str(access_token_for(other))
+
+    self.assertEqual(self.c.get('/api/tags/').json(), [])
+
+
+  def test_read_racing_a_write_is_not_kept(self):
+    def load():
+      # A write lands while the tags are being read
+      user_cache.invalidate(self.user.id, 'tags')
+      return ['stale']
+
+    user_cache.fetch(self.user.id, 'tags', load)
+
+    self.assertEqual(user_cache.fetch(self.user.id, 'tags', lambda: ['fresh']), ['fresh'])
+
+
+  @override_settings(**SHARED_CACHE)
+  def test_shared_backend(self):
+    caches['shared'].clear()
+    self.c.get('/api/tags/')
+    with self.assertNumQueries(0):
+      self.c.get('/api/tags/')
+
+    # Nothing is kept in-process, another worker
+    # would see the same entries and versions
+    user_cache.local.clear()
+    with self.assertNumQueries(0):
+      self.c.get('/api/tags/')
+
+    Tag.objects.create(name='home', user=self.user)
+    self.assertEqual(len(self.c.get('/api/tags/').json()), 2)
+
+
+  @override_settings(USER_CACHE={'BACKEND': 'shared', 'CACHE': 'default'})
+  def test_shared_backend_refuses_process_local_caches(self):
+    with self.assertRaises(ImproperlyConfigured):
+      user_cache.fetch(self.user.id, 'tags', list)
+
+
+
+# The cached tokens leave the 304s without any query
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': True}, **SHARED_CACHE)
+class ConditionalGetTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    revoked_tokens.sync()
+    token_cache.clear()
+    user_cache.clear()
+    caches['shared'].clear()
+
+    self.user = User.objects.get(username='test_user')
+    self.tag = Tag.objects.create(name='work', user=self.user)
+    self.mode = Mode.objects.create(name='Focus', user=self.user)
+    self.project = Project.objects.create(name='Project', user=self.user)
+    self.task = Task.objects.create(title='Task', estimated=1, user=self.user)
+    self.task.tags.add(self.tag)
+    Stats.objects.create(user=self.user)
+
+    self.c = Client()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+
+  def test_unchanged_responses_are_not_sent(self):
+    urls = [
+      '/api/tasks/', f'/api/tasks/{self.task.id}/',
+      '/api/projects/', f'/api/projects/{self.project.id}/',
+      '/api/tags/', '/api/modes/', '/api/stats/', f'/api/users/{self.user.id}/',
+      '/api/me/', '/api/currentTask/', '/api/currentMode/', '/api/tagInfo/work/',
+    ]
+    for url in urls:
+      with self.subTest(url=url):
+        etag = self.c.get(url)['ETag']
+        with self.assertNumQueries(0):
+          response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+
+  @override_settings(USER_CACHE={'BACKEND': 'local'})
+  def test_local_backend_hashes_the_response(self):
+    for url in ('/api/tasks/', '/api/tags/', '/api/me/', '/api/currentMode/'):
+      with self.subTest(url=url):
+        etag = self.c.get(url)['ETag']
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+
+  @override_settings(USER_CACHE={'BACKEND': 'local'})
+  def test_local_backend_sees_the_writes_of_other_workers(self):
+    etag = self.c.get('/api/tasks/')['ETag']
+
+    # Written by another worker, the versions of this one never change
+    with mock.patch.object(user_cache, 'invalidate'):
+      Task.objects.filter(id=self.task.id).update(title='Renamed')
+
+    response = self.c.get('/api/tasks/', HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertNotEqual(response['ETag'], etag)
+
+
+  def test_subtasks_saved_anywhere_change_the_etag(self):
+    etag = self.c.get('/api/tasks/')['ETag']
+
+    Subtask.objects.create(task=self.task, title='elsewhere')
+
+    response = self.c.get('/api/tasks/', HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+  def test_etags_differ_per_url(self):
+    first = self.c.get('/api/tasks/?page=1')['ETag']
+    second = self.c.get('/api/tasks/?page=1&fields=id')['ETag']
+
+    self.assertNotEqual(first, second)
+
+
+  def test_etags_differ_per_user(self):
+    etag = self.c.get('/api/tags/')['ETag']
+    other = User.objects.create(username='other_user', password='other_password')
+    self.c.cookies['access_token'] = str(access_token_for(other))
+
+    response = self.c.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+  def test_writes_change_the_etag(self):
+    writes = [
+      ('/api/tasks/', lambda: self.c.patch(
+        f'/api/tasks/{self.task.id}/', {'obj': 'task', 'action': 'done'},
+        content_type='application/json')),
+      ('/api/tasks/', lambda: self.c.post(
+        '/api/tasks/bulk_done/', {'ids': [self.task.id], 'done': False},
+        content_type='application/json')),
+      ('/api/projects/', lambda: self.c.post(
+        '/api/tasks/bulk_add_to_project/', {'ids': [self.task.id], 'project_id': self.project.id},
+        content_type='application/json')),
+      ('/api/tasks/', self.rename_tag),
+      ('/api/stats/', lambda: self.c.post('/api/stats/', {'day': '2024-01-01'})),
+      ('/api/currentTask/', lambda: self.c.put(
+        '/api/currentTask/', {'id': self.task.id}, content_type='application/json')),
+    ]
+    for url, write in writes:
+      with self.subTest(url=url):
+        etag = self.c.get(url)['ETag']
+        write()
+
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+  def rename_tag(self):
+    self.tag.name = 'renamed'
+    self.tag.save()
+
+
+  def test_failed_writes_keep_the_etag(self):
+    etag = self.c.get('/api/tasks/')['ETag']
+
+    self.c.post('/api/tasks/bulk_done/', {'ids': []}, content_type='application/json')
+
+    response = self.c.get('/api/tasks/', HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+
+class ChangeFeedTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    revoked_tokens.sync()
+
+    self.user = User.objects.get(username='test_user')
+    self.task = Task.objects.create(title='Task', estimated=1, user=self.user)
+
+    self.c = Client()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+    self.cursor = self.c.get('/api/changes/').json()['cursor']
+
+
+  def changes(self, **params):
+    response = self.c.get('/api/changes/', {'since': self.cursor, **params})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return response.json()
+
+
+  def test_head_has_no_changes(self):
+    self.assertEqual(self.changes()['changes'], [])
+
+
+  def test_saved_rows_carry_their_data(self):
+    self.c.patch(f'/api/tasks/{self.task.id}/', {
+      'obj': 'subtask', 'action': 'add', 'subtask': {'title': 'Subtask'},
+    }, content_type='application/json')
+    tag = Tag.objects.create(name='work', user=self.user)
+
+    self.task.refresh_from_db()
+    self.assertEqual(self.changes()['changes'], [
+      {'type': 'task', 'id': self.task.id, 'data': TaskSerializer(self.task).data},
+      {'type': 'tag', 'id': tag.id, 'data': TagSerializer(tag).data},
+    ])
+
+
+  def test_bulk_writes_are_logged(self):
+    other = Task.objects.create(title='Other', estimated=1, user=self.user)
+    self.cursor = self.changes()['cursor']
+
+    self.c.post('/api/tasks/bulk_done/', {'ids': [self.task.id]}, content_type='application/json')
+    self.c.post('/api/tasks/bulk_delete/', {'ids': [other.id]}, content_type='application/json')
+    self.c.post('/api/stats/', {'day': '2024-01-01'})
+
+    changes = self.changes()['changes']
+    self.assertEqual([(change['type'], change['id']) for change in changes], [
+      ('task', self.task.id), ('task', other.id), ('stats', Stats.objects.get(user=self.user).id)])
+    self.assertTrue(changes[0]['data']['done'])
+    self.assertTrue(changes[1]['deleted'])
+
+
+  def test_each_row_appears_once(self):
+    for _ in range(3):
+      self.c.patch(f'/api/tasks/{self.task.id}/', {'obj': 'task', 'action': 'done'},
+                   content_type='application/json')
+    self.c.delete(f'/api/tasks/{self.task.id}/')
+
+    self.assertEqual(self.changes()['changes'], [
+      {'type': 'task', 'id': self.task.id, 'deleted': True}])
+
+
+  def test_pages(self):
+    tasks = [Task.objects.create(title=f'Task {i}', estimated=1, user=self.user) for i in range(3)]
+
+    first = self.changes(limit=2)
+    self.cursor = first['cursor']
+    second = self.changes(limit=2)
+    self.cursor = second['cursor']
+
+    self.assertTrue(first['more'])
+    self.assertFalse(second['more'])
+    self.assertEqual(
+      [change['id'] for change in first['changes'] + second['changes']],
+      [task.id for task in tasks])
+    self.assertEqual(self.changes()['changes'], [])
+
+
+  def test_other_users_changes_are_not_seen(self):
+    other = User.objects.create(username='other_user', password='other_password')
+    Task.objects.create(title='Not yours', estimated=1, user=other)
+
+    self.assertEqual(self.changes()['changes'], [])
+
+
+  def test_invalid_cursor(self):
+    response = self.c.get('/api/changes/', {'since': 'nope'})
+
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+  def test_expired_cursor(self):
+    with override_settings(CHANGE_FEED={'RETENTION': 0}):
+      response = self.c.get('/api/changes/', {'since': '1.1'})
+
+    self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+
+
+@override_settings(AUTH_TOKEN_CACHE={'ENABLED': True})
+class BootstrapTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    revoked_tokens.sync()
+    token_cache.clear()
+    user_cache.clear()
+    row_counters['tasks'].clear()
+    row_counters['projects'].clear()
+
+    self.user = User.objects.get(username='test_user')
+    self.mode = Mode.objects.create(name='Focus', user=self.user)
+    self.c = Client()
+    self.add_rows(1)
+
+
+  def add_rows(self, count):
+    for i in range(count):
+      tag = Tag.objects.create(name=f'tag_{Tag.objects.count()}', user=self.user)
+      task = Task.objects.create(title=f'Task {i}', estimated=1, user=self.user)
+      task.tags.add(tag)
+      Subtask.objects.create(task=task, title='subtask')
+      project = Project.objects.create(name=f'Project {i}', user=self.user)
+      project_task = Task.objects.create(title=f'Project task {i}', estimated=1, user=self.user, in_project=True)
+      project_task.tags.add(tag)
+      project.tasks.add(project_task, task)
+
+    # Tasks of projects are left out of the tasks' first page
+    self.user.current_task_id = Task.objects.filter(user=self.user, in_project=True).first().id
+    self.user.current_mode_id = self.mode.id
+    self.user.save()
+    self.c.cookies['access_token'] = str(access_token_for(self.user))
+
+
+  def bootstrap(self, **headers):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.get('/api/bootstrap/', **headers)
+    return response, len(queries)
+
+
+  def test_matches_the_endpoints(self):
+    data = self.bootstrap()[0].json()
+
+    self.assertEqual(data['me'], self.c.get('/api/me/').json())
+    self.assertEqual(data['current_mode'], self.c.get('/api/currentMode/').json())
+    self.assertEqual(data['modes'], self.c.get('/api/modes/').json())
+    self.assertEqual(data['tags'], self.c.get('/api/tags/').json())
+    self.assertEqual(
+      data['current_task'], self.c.get(f'/api/tasks/{self.user.current_task_id}/').json())
+
+    for route in ('tasks', 'projects'):
+      with self.subTest(route=route):
+        page = self.c.get(f'/api/{route}/').json()
+        self.assertEqual(data[route]['count'], page['count'])
+        self.assertEqual(data[route]['results'], page['results'])
+        self.assertEqual(data[route]['next'], page['next'])
+
+
+  def test_queries_do_not_grow(self):
+    _, small = self.bootstrap()
+    self.add_rows(10)
+    user_cache.clear()
+    row_counters['tasks'].clear()
+    row_counters['projects'].clear()
+    token_cache.clear()
+    _, large = self.bootstrap()
+
+    self.assertEqual(small, large)
+
+
+  @override_settings(**SHARED_CACHE)
+  def test_revalidation(self):
+    caches['shared'].clear()
+    response, _ = self.bootstrap()
+
+    not_modified, queries = self.bootstrap(HTTP_IF_NONE_MATCH=response['ETag'])
+    self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+    self.assertEqual(queries, 0)
+
+    Tag.objects.create(name='new', user=self.user)
+    modified, _ = self.bootstrap(HTTP_IF_NONE_MATCH=response['ETag'])
+    self.assertEqual(modified.status_code, status.HTTP_200_OK)
+
+
+
+class NormalizedFormatTestCase(TestCase):
+  def setUp(self):
+    auth = AuthUtils()
+    auth.auth()
+    self.c = Client()
+    self.c.cookies['access_token'] = auth.access_token
+
+    self.user = User.objects.get(username='test_user')
+    self.tags = [Tag.objects.create(name=f'tag_{i}', user=self.user) for i in range(2)]
+    self.project = Project.objects.create(name='Project', user=self.user)
+
+    for i in range(3):
+      task = Task.objects.create(title=f'Task {i}', estimated=1, user=self.user)
+      task.tags.add(*self.tags)
+      Subtask.objects.create(task=task, title=f'Subtask {i}')
+      self.project.tasks.add(task)
+
+
+  def get(self, url, **params):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.c.get(url, params)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return response.json(), len(queries)
+
+
+  def test_tasks(self):
+    # Both requests then find the token in the token cache
+    self.get('/api/tasks/')
+    nested, nested_queries = self.get('/api/tasks/')
+    normalized, normalized_queries = self.get('/api/tasks/', normalize='true')
+
+    self.assertEqual(nested_queries, normalized_queries)
+    self.assertEqual(normalized['count'], nested['count'])
+    for task, expanded in zip(normalized['results'], nested['results']):
+      for name in ('tags', 'subtasks', 'project_tasks'):
+        self.assertEqual(task[name], [obj['id'] for obj in expanded[name]])
+        for obj in expanded[name]:
+          self.assertEqual(normalized['included'][name][str(obj['id'])], obj)
+
+    self.assertEqual(len(normalized['included']['tags']), 2)
+    self.assertEqual(len(normalized['included']['project_tasks']), 1)
+
+
+  def test_project(self):
+    nested, _ = self.get(f'/api/projects/{self.project.id}/')
+    normalized, _ = self.get(f'/api/projects/{self.project.id}/', normalize='true')
+
+    data = normalized['data']
+    self.assertEqual(data['name'], nested['name'])
+    self.assertEqual([task['title'] for task in data['tasks']],
+                     [task['title'] for task in nested['tasks']])
+    self.assertEqual([task['tags'] for task in data['tasks']],
+                     [[tag.id for tag in self.tags]] * 3)
+    self.assertEqual(
+      normalized['included']['tags'],
+      {str(tag['id']): tag for tag in nested['tasks'][0]['tags']})
+    self.assertEqual(len(normalized['included']['subtasks']), 3)
+
+
+  def test_fields_are_kept(self):
+    normalized, _ = self.get('/api/tasks/', normalize='true', fields='title,tags')
+
+    self.assertEqual(set(normalized['results'][0]), {'id', 'title', 'tags'})
+    self.assertEqual(set(normalized['included']), {'tags'})
+
+    normalized, _ = self.get('/api/projects/', normalize='true', fields='name,tasks.title')
+
+    self.assertEqual(set(normalized['results'][0]), {'id', 'name', 'tasks'})
+    self.assertEqual(set(normalized['results'][0]['tasks'][0]), {'id', 'title'})
+
+
+  def test_nested_by_default(self):
+    nested, _ = self.get('/api/projects/')
+
+    self.assertNotIn('included', nested)
+    self.assertEqual(nested['results'][0]['tasks'][0]['tags'][0]['name'], 'tag_0')
@@ -1,5 +1,8 @@
-from django.test import TestCase
-from .models import Task, Project, Subtask, Tag, Stats, Mode, User
+from django.test import TestCase, TransactionTestCase
+from django.db import connection, OperationalError
+from django.utils import timezone
+from .models import Task, Project, Subtask, Tag, Stats, Mode, User, Change
+from threading import Thread
 import datetime
 
 
@@ -256,3 +259,127 @@ class SubtaskTestCase(TestCase):
   def test_task_subtasks(self):
     self.assertQuerysetEqual(self.task.subtasks.all(), [self.subtask_1, self.subtask_2], ordered=False)
     self.assertEqual(self.task.subtasks.count(), 2)
+
+
+
+class AtomicCountersTestCase(TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='test_user', password='test_pass')
+    self.task = Task.objects.create(title='Counted', user=self.user)
+
+
+  def test_increment_gone_through(self):
+    self.assertEqual(Task.objects.increment_gone_through(self.task.id), 1)
+    self.assertEqual(Task.objects.increment_gone_through(self.task.id), 2)
+    self.task.refresh_from_db()
+    self.assertEqual(self.task.gone_through, 2)
+
+
+  def test_increment_missing_task(self):
+    self.assertIsNone(Task.objects.increment_gone_through(self.task.id + 1))
+
+
+  def test_increment_chores(self):
+    first = Stats.objects.increment_chores(self.user.id, '2022-11-11')
+    second = Stats.objects.increment_chores(self.user.id, '2022-11-11')
+    other_day = Stats.objects.increment_chores(self.user.id, '2022-11-12')
+
+    self.assertEqual(first.id, second.id)
+    self.assertEqual(second.chores_done, 2)
+    self.assertEqual(second.day, datetime.date(2022, 11, 11))
+    self.assertEqual(other_day.chores_done, 1)
+    self.assertEqual(Stats.objects.get(id=first.id).chores_done, 2)
+
+
+class AtomicCountersStressTestCase(TransactionTestCase):
+  threads = 8
+  increments = 25
+
+  def setUp(self):
+    self.user = User.objects.create(username='test_user', password='test_pass')
+    self.task = Task.objects.create(title='Counted', user=self.user)
+
+
+  def run_concurrently(self, increment):
+    def worker():
+      try:
+        done = 0
+        while done < self.increments:
+          try:
+            increment()
+            done += 1
+          except OperationalError:
+            # SQLite may report the table as locked, the
+            # statement did not run and is retried
+            pass
+      finally:
+        connection.close()
+
+    threads = [Thread(target=worker) for _ in range(self.threads)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+
+  def test_no_lost_gone_through_increments(self):
+    self.run_concurrently(lambda: Task.objects.increment_gone_through(self.task.id))
+
+    self.task.refresh_from_db()
+    self.assertEqual(self.task.gone_through, self.threads * self.increments)
+
+
+  def test_no_lost_chores(self):
+    self.run_concurrently(lambda: Stats.objects.increment_chores(self.user.id, '2022-11-11'))
+
+    stat = Stats.objects.get(user=self.user)
+    self.assertEqual(stat.chores_done, self.threads * self.increments)
+
+
+
+class ChangeLogTestCase(TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='test_user', password='test_password')
+    Change.objects.all().delete()
+
+
+  def test_batch_records_once(self):
+    with self.assertNumQueries(1):
+      with Change.objects.batch():
+        Change.objects.record(self.user.id, 'task', [1, 2])
+        Change.objects.record(self.user.id, 'task', [3])
+
+    self.assertEqual(Change.objects.count(), 3)
+
+
+  def test_failed_batch_records_nothing(self):
+    with self.assertRaises(ValueError):
+      with Change.objects.batch():
+        Change.objects.record(self.user.id, 'task', [1])
+        raise ValueError
+
+    self.assertFalse(Change.objects.exists())
+
+
+  def test_compact(self):
+    old = timezone.now() - datetime.timedelta(days=30)
+    Change.objects.record(self.user.id, 'task', [1])
+    Change.objects.record(self.user.id, 'task', [1, 2])
+    Change.objects.record(self.user.id, 'tag', [1], deleted=True)
+    Change.objects.filter(kind='tag').update(created_at=old)
+    Change.objects.record(self.user.id, 'mode', [1], deleted=True)
+
+    deleted = Change.objects.compact(timezone.now() - datetime.timedelta(days=7))
+
+    self.assertEqual(deleted, 2)
+    self.assertEqual(
+      sorted(Change.objects.values_list('kind', 'object_id', 'deleted')),
+      [('mode', 1, True), ('task', 1, False), ('task', 2, False)])
+
+
+  def test_deleted_users_changes_are_dropped(self):
+    Task.objects.create(title='Task', user=self.user)
+
+    self.user.delete()
+
+    self.assertFalse(Change.objects.filter(user_id=self.user.id).exists())
@@ -15,6 +15,8 @@ urlpatterns = [
     path('currentTask/', views.CurrentTaskView.as_view()),
     path('currentMode/', views.CurrentModeView.as_view()),
     path('tagInfo/<str:name>/', views.TagInfo.as_view()),
+    path('changes/', views.ChangesView.as_view()),
+    path('bootstrap/', views.BootstrapView.as_view()),
 
     # User Router
     path('me/', views.CurrentUserView.as_view()),
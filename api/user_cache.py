@@ -0,0 +1,178 @@
+from collections import Counter
+from threading import Lock
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from .cache import LRUCache
+import time
+
+# The resources versioned per user, the first three
+# are also cached
+RESOURCES = ('tags', 'modes', 'me', 'tasks', 'projects', 'stats')
+
+# Django caches which are not seen by the other workers,
+# refused by the shared backend
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def user_cache_settings():
+    return {
+        'BACKEND': 'local',
+        'CACHE': 'default',
+        'MAX_SIZE': 4096,
+        'TTL': 300,
+        **getattr(settings, 'USER_CACHE', {})
+    }
+
+
+class LocalBackend:
+    """
+    The part of Django's cache API used by UserCache,
+    over an in-process LRUCache
+    """
+
+    def __init__(self, max_size):
+        self.entries = LRUCache(max_size)
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self.entries.set(
+            key, value, None if timeout is None else time.time() + timeout)
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self.entries.get(key) is not None:
+                return False
+            self.set(key, value, timeout)
+            return True
+
+    def clear(self):
+        self.entries.clear()
+
+
+class UserCache:
+    """
+    Read-through cache of the rows of a user which
+    rarely change, kept per resource ('tags', 'modes', 'me')
+
+    Every resource of a user has a version, the entries are
+    stored under it and a write replaces it instead of deleting
+    them, see signals.py. A read which started before the
+    write can then only store its result under the old
+    version, where it is never looked up again. The versions
+    of the shared backend also make the ETags of the views,
+    see conditional.py.
+
+    The entries are kept in-process by default, or in one
+    of the Django caches with BACKEND 'shared', so every
+    worker sees the writes of the others. The shared cache
+    has to be one every worker reaches, such as Redis or
+    Memcached. Hits and misses are counted per resource and
+    per process.
+    """
+
+    def __init__(self, max_size):
+        self.local = LocalBackend(max_size)
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = Lock()
+
+    @property
+    def shared(self):
+        """
+        Whether every worker sees the same versions
+        """
+        return user_cache_settings()['BACKEND'] == 'shared'
+
+    @property
+    def backend(self):
+        if not self.shared:
+            return self.local
+
+        cache = caches[user_cache_settings()['CACHE']]
+        if isinstance(cache, PROCESS_LOCAL_CACHES):
+            raise ImproperlyConfigured(
+                f"USER_CACHE 'shared' needs a cache seen by every worker, "
+                f"not a {type(cache).__name__}")
+        return cache
+
+    def key(self, user_id, resource, suffix):
+        return f'user_cache:{user_id}:{resource}:{suffix}'
+
+    def version(self, user_id, resource):
+        """
+        Returns the version of the user's resource, the
+        versions are the time they were set at so a new one
+        never matches the entries of an evicted one
+        """
+        backend = self.backend
+        key = self.key(user_id, resource, 'version')
+
+        version = backend.get(key)
+        if version is None:
+            version = time.time_ns()
+            if not backend.add(key, version, user_cache_settings()['TTL']):
+                version = backend.get(key, version)
+        return version
+
+    def fetch(self, user_id, resource, load):
+        """
+        Returns the cached value of the user's resource,
+        calling load and caching its result on a miss
+
+        Keyword arguments:
+        load -- returns the value, it has to be picklable
+                for the shared backend
+        """
+        backend = self.backend
+        key = self.key(user_id, resource, self.version(user_id, resource))
+
+        value = backend.get(key)
+        with self._lock:
+            (self.misses if value is None else self.hits)[resource] += 1
+
+        if value is None:
+            value = load()
+            backend.set(key, value, user_cache_settings()['TTL'])
+        return value
+
+    def invalidate(self, user_id, *resources):
+        """
+        Gives the user's resources new versions, the versions
+        expire after TTL seconds too so a write seen by a single
+        worker of the local backend only goes unnoticed that long
+        """
+        backend = self.backend
+        for resource in resources:
+            backend.set(
+                self.key(user_id, resource, 'version'),
+                time.time_ns(),
+                user_cache_settings()['TTL'])
+
+    def stats(self):
+        """
+        Returns the hits and misses of every resource
+        """
+        with self._lock:
+            return {
+                resource: {'hits': self.hits[resource], 'misses': self.misses[resource]}
+                for resource in sorted(self.hits.keys() | self.misses.keys())
+            }
+
+    def clear(self):
+        """
+        Drops the in-process entries and counters, the
+        entries of a shared backend are left alone
+        """
+        self.local.clear()
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+
+user_cache = UserCache(user_cache_settings()['MAX_SIZE'])
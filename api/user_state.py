@@ -0,0 +1,84 @@
+from django.db.models import Exists, OuterRef, Q
+from .auth import CLAIM_FIELDS, token_cache, claims_versions, refresh_access_cookie
+from .models import User, Task, Mode, Change
+from .user_cache import user_cache
+import time
+
+
+class UserState:
+    """
+    Changes the current task and mode of a user with
+    targeted single column UPDATEs, without loading
+    the user's row
+
+    The ids are checked to be the user's in the same
+    statement, which also gives the row a new claims_version.
+    After every change the cached tokens and info of the
+    user are dropped and the change is logged
+
+    Keyword arguments:
+    user -- the request's user, a User or the TokenUser
+            built by ClaimsAuthentication
+    """
+
+    def __init__(self, user):
+        if not isinstance(user, User):
+            # Enough of a user to issue tokens with its claims, the
+            # id of a TokenUser is the claim's str
+            user = User(id=int(user.id), **{claim: getattr(user, claim) for claim in CLAIM_FIELDS})
+        self.user = user
+
+    def _update(self, *conditions, **values):
+        """
+        Runs the UPDATE if the conditions, Q or Exists
+        expressions, hold and copies the values to the
+        user, returns whether it did
+        """
+        values['claims_version'] = time.time_ns()
+        updated = User.objects.filter(*conditions, id=self.user.id).update(**values)
+
+        if updated:
+            for field, value in values.items():
+                setattr(self.user, field, User._meta.get_field(field).to_python(value))
+            token_cache.invalidate_user(self.user.id)
+            claims_versions.set(self.user.id, self.user.claims_version)
+            user_cache.invalidate(self.user.id, 'me')
+            Change.objects.record(self.user.id, 'user', [self.user.id])
+        return bool(updated)
+
+    def set_current_task(self, task_id):
+        """
+        Sets the current task, 0 clears it. Returns False
+        if the task is not one of the user's
+        """
+        conditions = []
+        if task_id:
+            conditions.append(Exists(Task.objects.filter(id=task_id, user_id=OuterRef('id'))))
+        return self._update(*conditions, current_task_id=task_id)
+
+    def set_current_mode(self, mode_id):
+        """
+        Sets the current mode, 0 is the default one. Returns
+        False if the mode is not one of the user's
+        """
+        conditions = []
+        if mode_id:
+            conditions.append(Exists(Mode.objects.filter(id=mode_id, user_id=OuterRef('id'))))
+        return self._update(*conditions, current_mode_id=mode_id)
+
+    def reset_current_task(self, task_ids):
+        """
+        Clears the current task if it is one of task_ids,
+        returns whether it was
+        """
+        return self._update(Q(current_task_id__in=task_ids), current_task_id=0)
+
+    def reset_current_mode(self, mode_id):
+        """
+        Goes back to the default mode if mode_id is the
+        current one, returns whether it was
+        """
+        return self._update(Q(current_mode_id=mode_id), current_mode_id=0)
+
+    def refresh_access_cookie(self, response):
+        refresh_access_cookie(response, self.user)
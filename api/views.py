@@ -5,69 +5,231 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework import permissions, status
-from rest_framework.pagination import PageNumberPagination
 from django.http import Http404
+from django.urls import reverse
+from django.db import transaction
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.conf import settings
-
-
-class ProjectResultsSetPagination(PageNumberPagination):
+from .conditional import ConditionalGetMixin
+from .changes import ChangeFeed, change_feed_settings
+from .auth import (
+    ClaimsAuthentication, refresh_access_cookie,
+    store_refresh_token, clear_refresh_token, has_refresh_token, revoke_tokens)
+from .fieldsets import Fieldset
+from .pagination import OptionalCursorPagination, KeysetPagination, row_counters
+from .revocation import revoked_tokens
+from .scopes import UserScopeMixin
+from .user_state import UserState
+from .modes import user_modes, current_mode
+from .user_cache import user_cache
+
+
+class ProjectResultsSetPagination(OptionalCursorPagination):
     """Sets the page size and max size for Project Pagination"""
     page_size = 2
     page_size_query_param = 'page_size'
     max_page_size = 10
+    counter = 'projects'
 
 
-class TaskResultsSetPagination(PageNumberPagination):
+class TaskResultsSetPagination(OptionalCursorPagination):
     """Sets the page size and max size for Task Pagination"""
     page_size = 4
     page_size_query_param = 'page_size'
     max_page_size = 10
+    counter = 'tasks'
+
+
+def delete_tasks(user, tasks, response):
+    """
+    Deletes the tasks with set-based DELETEs, resets the user's
+    current task if it was one of them, drops the cached
+    counts and records the changes the signals would have
+
+    Keyword arguments:
+    response -- gets the new access token if the current task changed
+    """
+    ids, tag_ids = tasks.delete_in_bulk()
+    Change.objects.record(user.id, 'task', ids, deleted=True)
+
+    row_counters['tasks'].invalidate(user.id)
+    for tag_id in tag_ids:
+        row_counters['tags'].invalidate(tag_id)
+
+    user_state = UserState(user)
+    if ids and user_state.reset_current_task(ids):
+        user_state.refresh_access_cookie(response)
+
+    return ids
+
+
+def user_tags(scope):
+    """
+    Returns the user's serialized tags, read through the user cache
+    """
+    return user_cache.fetch(scope.user_id, 'tags', lambda: list(
+        TagSerializer(scope.tags, many=True).data))
+
+
+def user_info(user):
+    """
+    Returns the user's serialized info, read through the user cache
+    """
+    return user_cache.fetch(user.id, 'me', lambda: dict(UserSerializer(user).data))
+
+
+class TagTasksPagination(KeysetPagination):
+    """
+    Pages through the tasks of a tag, the response
+    always carries the tag's cached total
+    """
+    page_size = 20
+    max_page_size = 100
+
+    def __init__(self, tag):
+        super().__init__()
+        self.tag = tag
+
+    def get_count(self, queryset, request):
+        return row_counters['tags'].count(self.tag.id, self.tag.tasks.all())
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class FieldsetViewMixin:
+    """
+    Reads the ?fields= and ?expand= query parameters
+    and passes them on to the serializer
+
+    ?normalize=true renders the relations as ids, except the
+    serializer's inline_fields, and every object they refer to
+    once in a top-level included map of field name -> id -> object.
+    ?expand= is left aside then
+    """
+    def normalizes(self):
+        return (self.request.method == 'GET'
+                and self.request.query_params.get('normalize') in ('true', '1'))
+
+    def get_fieldset(self):
+        """
+        Returns the requested fieldset, the one the queryset
+        prefetches. The normalized format expands everything,
+        the included objects are read out of the prefetches,
+        and always renders the ids the objects are referred by
+        """
+        fieldset = Fieldset.from_request(self.request)
+        if self.normalizes():
+            return Fieldset(fieldset.fields).with_ids()
+        return fieldset
+
+    def get_serializer(self, *args, **kwargs):
+        fieldset = self.get_fieldset()
+        if self.normalizes():
+            fieldset = fieldset.inline(self.get_serializer_class().inline_fields)
+
+        kwargs.setdefault('fieldset', fieldset)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_included(self, instances):
+        included = {}
+        self.get_serializer_class()(fieldset=self.get_fieldset()).side_load(instances, included)
+        return included
+
+    def represent(self, instance):
+        """
+        Returns the instance as the detail endpoints answer it,
+        in the normalized format if it was asked for
+        """
+        data = self.get_serializer(instance).data
+        if not self.normalizes():
+            return data
+        return {'data': data, 'included': self.get_included([instance])}
+
+    def list(self, request, *args, **kwargs):
+        if not self.normalizes():
+            return super().list(request, *args, **kwargs)
+
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        response.data['included'] = self.get_included(page)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.represent(self.get_object()), status=status.HTTP_200_OK)
+
+
+class UserViewSet(ConditionalGetMixin, UserScopeMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('me',)
+    write_resources = ('me',)
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        """
+        Returns the current user only
+        """
+        return User.objects.filter(id=self.scope.user_id)
+
+    def perform_update(self, serializer):
+        self.updated_user = serializer.save()
+
+    def update(self, request, *args, **kwargs):
+        """
+        Updates the user, and the token's claims
+        if the user is the current one
+        """
+        response = super().update(request, *args, **kwargs)
 
-class StatsViewSet(viewsets.ModelViewSet):
+        if self.updated_user.id == request.user.id:
+            refresh_access_cookie(response, self.updated_user)
+        return response
+
+
+class StatsViewSet(ConditionalGetMixin, UserScopeMixin, viewsets.ModelViewSet):
     queryset = Stats.objects.all()
+    authentication_classes = [ClaimsAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('stats',)
+    write_resources = ('stats',)
     serializer_class = StatsSerializer
 
     def get_queryset(self):
         """
         Returns current user's stats
         """
-        return self.request.user.stats.all().order_by('day')
+        return self.scope.stats.order_by('day')
 
     def create(self, request):
         """
         Creates a new stat for the current day
         """
-        # See if there is a stat with the same date
-        stat, created = Stats.objects.get_or_create(
-            user=request.user, day=request.data['day'])
-
-        stat.chores_done = 1 if created else stat.chores_done + 1
-        stat.save()
+        # Creates the day's stat or adds one to it
+        stat = Stats.objects.increment_chores(request.user.id, request.data['day'])
+        Change.objects.record(request.user.id, 'stats', [stat.id])
 
         return Response(
             StatsSerializer(stat).data,
             status=status.HTTP_201_CREATED)
 
 
-class ModeViewSet(viewsets.ModelViewSet):
+class ModeViewSet(ConditionalGetMixin, UserScopeMixin, viewsets.ModelViewSet):
     queryset = Mode.objects.all()
+    authentication_classes = [ClaimsAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('modes',)
+    write_resources = ('modes',)
     serializer_class = ModesSerializer
 
     def get_queryset(self):
         """
         Returns current user's modes
         """
-        return self.request.user.modes.all()
+        return self.scope.modes
+
+    def list(self, request):
+        """
+        Returns current user's modes, read through the user cache
+        """
+        return Response(user_modes(request.user.id), status=status.HTTP_200_OK)
 
     def create(self, request):
         """
@@ -91,7 +253,7 @@ class ModeViewSet(viewsets.ModelViewSet):
         serializer = ModesSerializer(data=request.data)
 
         if serializer.is_valid():
-            mode = Mode.objects.create(**serializer.data, user=request.user)
+            mode = Mode.objects.create(**serializer.data, user_id=request.user.id)
             return Response(
                 ModesSerializer(mode).data,
                 status=status.HTTP_201_CREATED)
@@ -102,25 +264,139 @@ class ModeViewSet(viewsets.ModelViewSet):
         """
         Deletes a mode from the current user
         """
-        # Reset to default if the current timer is the one
-        # being deleted
-        if request.user.current_mode_id == int(pk):
-            user = User.objects.get(id=request.user.id)
-            user.current_mode_id = 0
-            user.save()
+        with transaction.atomic(), Change.objects.batch():
+            deleted, _ = self.scope.modes.filter(id=pk).delete()
+            if not deleted:
+                raise Http404
+
+            # Reset to default if the current timer is the one
+            # being deleted
+            user_state = UserState(request.user)
+            if not user_state.reset_current_mode(pk):
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+        response = Response(
+            'Back to default',
+            status=status.HTTP_204_NO_CONTENT)
+        user_state.refresh_access_cookie(response)
+        return response
 
-            mode_to_delete = Mode.objects.get(id=int(pk))
-            mode_to_delete.delete()
 
-            return Response(
-                'Back to default',
-                status=status.HTTP_204_NO_CONTENT)
-        return super().destroy(request)
+class TaskBatch:
+    """
+    Applies the live edits of a task, its tags and subtasks
+    are loaded once and shared by every operation
+
+    Each operation returns a (status, data) pair, the same
+    ones TaskViewSet.partial_update answers with
+    """
+    def __init__(self, task, user):
+        self.task = task
+        self.user = user
+        self.tags = {tag.id: tag for tag in task.tags.all()}
+        self.subtasks = {subtask.id: subtask for subtask in task.subtasks.all()}
+
+    def apply(self, operation):
+        if not isinstance(operation, dict):
+            return status.HTTP_400_BAD_REQUEST, {'message': 'operation must be an object'}
+
+        handler = getattr(
+            self, f"{operation.get('obj')}_{operation.get('action')}", None)
+        if handler is None:
+            return status.HTTP_400_BAD_REQUEST, {'message': 'unknown operation'}
+        try:
+            return handler(operation)
+        except KeyError as error:
+            return status.HTTP_400_BAD_REQUEST, {'message': f'missing {error}'}
+
+    def object_id(self, operation, key):
+        """
+        Returns the id under key, None for anything but
+        an int, which no tag or subtask has
+        """
+        value = operation[key]
+        return value if isinstance(value, int) else None
+
+    def tag_add(self, operation):
+        name = operation['tag_name']
+        if any(tag.name == name for tag in self.tags.values()):
+            return status.HTTP_400_BAD_REQUEST, {'message': 'tag already exists in task'}
+
+        tag, is_new = Tag.objects.get_or_create(user=self.user, name=name)
+        self.task.tags.add(tag)
+        self.tags[tag.id] = tag
+
+        if is_new:
+            return status.HTTP_201_CREATED, {'message': 'new', 'tag': TagSerializer(tag).data}
+        return status.HTTP_200_OK, {'tag': TagSerializer(tag).data}
+
+    def tag_remove(self, operation):
+        tag = self.tags.pop(self.object_id(operation, 'tag_id'), None)
+        if tag is None:
+            return status.HTTP_404_NOT_FOUND, {'message': 'tag not in task'}
+
+        self.task.tags.remove(tag)
+        return status.HTTP_200_OK, {'message': 'tag removed'}
+
+    def subtask_add(self, operation):
+        serializer = SubtaskSerializer(data=operation['subtask'])
+        if not serializer.is_valid():
+            return status.HTTP_400_BAD_REQUEST, serializer.errors
 
+        subtask = serializer.save(task=self.task)
+        self.subtasks[subtask.id] = subtask
+        return status.HTTP_201_CREATED, SubtaskSerializer(subtask).data
 
-class TaskViewSet(viewsets.ModelViewSet):
+    def subtask_remove(self, operation):
+        subtask = self.subtasks.pop(self.object_id(operation, 'subtask_id'), None)
+        if subtask is None:
+            return status.HTTP_404_NOT_FOUND, {'message': 'subtask not in task'}
+
+        subtask.delete()
+        Change.objects.record(self.user.id, 'task', [self.task.id])
+        return status.HTTP_204_NO_CONTENT, {'message': 'subtask removed'}
+
+    def subtask_update(self, operation):
+        data = operation['subtask']
+        if not isinstance(data, dict):
+            return status.HTTP_400_BAD_REQUEST, {'message': 'subtask must be an object'}
+
+        subtask = self.subtasks.get(self.object_id(data, 'id'))
+        if subtask is None:
+            return status.HTTP_404_NOT_FOUND, {'message': 'subtask not in task'}
+
+        serializer = SubtaskSerializer(subtask, data=data)
+        if not serializer.is_valid():
+            return status.HTTP_400_BAD_REQUEST, serializer.errors
+
+        serializer.save()
+        return status.HTTP_200_OK, {'message': 'updated'}
+
+    def subtask_done(self, operation):
+        subtask = self.subtasks.get(self.object_id(operation, 'subtask_id'))
+        if subtask is None:
+            return status.HTTP_404_NOT_FOUND, {'message': 'subtask not in task'}
+
+        subtask.done = not subtask.done
+        subtask.save(update_fields=['done'])
+        return status.HTTP_200_OK, {'done': subtask.done}
+
+    def task_done(self, operation):
+        self.task.done = not self.task.done
+        self.task.save(update_fields=['done'])
+        return status.HTTP_200_OK, {'done': self.task.done}
+
+    def task_increment_gone_through(self, operation):
+        self.task.gone_through = Task.objects.increment_gone_through(self.task.id)
+        Change.objects.record(self.user.id, 'task', [self.task.id])
+        return status.HTTP_200_OK, self.task.gone_through
+
+
+class TaskViewSet(ConditionalGetMixin, UserScopeMixin, FieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Task.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('tasks', 'tags', 'projects')
+    write_resources = ('tasks', 'projects')
     serializer_class = TaskSerializer
     pagination_class = TaskResultsSetPagination
 
@@ -129,18 +405,19 @@ class TaskViewSet(viewsets.ModelViewSet):
         Returns the current user's tasks
         in descending order
         """
-        return self.request.user.tasks.all().filter(in_project=False).order_by('-id')
+        return self.scope.tasks.filter(
+            in_project=False).order_by('-id').with_details(self.get_fieldset())
 
     def retrieve(self, request, pk=None):
         """
         Return a certain task info based on the
         authenticated user
         """
-        task = Task.objects.filter(id=pk).first()
-        if task.user != request.user:
+        task = self.scope.tasks.with_details(self.get_fieldset()).filter(id=pk).first()
+        if task is None:
             return Response({"data": "error"},
                             status=status.HTTP_400_BAD_REQUEST)
-        return Response(TaskSerializer(task).data, status=status.HTTP_200_OK)
+        return Response(self.represent(task), status=status.HTTP_200_OK)
 
     def create(self, request):
         """
@@ -153,19 +430,18 @@ class TaskViewSet(viewsets.ModelViewSet):
         tags = request.data.get('tags')
 
         if serializer.is_valid():
-            task = Task(user=request.user, **serializer.data)
-            task.save()
+            with transaction.atomic(), Change.objects.batch():
+                task = Task.objects.create(user=request.user, **serializer.data)
 
-            # Add tags
-            if tags:
-                for tag in tags:
-                    tag_obj, _ = Tag.objects.get_or_create(name=tag['name'], user=request.user)
-                    task.tags.add(tag_obj)
+                # Add tags, the through rows are inserted at once
+                if tags:
+                    task.tags.add(*Tag.objects.get_or_create_many(
+                        request.user, [tag['name'] for tag in tags]))
 
-            # Add subtasks
-            if subtasks:
-                for subtask in subtasks:
-                    Subtask.objects.create(task=task, **subtask)
+                # Add subtasks
+                if subtasks:
+                    Subtask.objects.bulk_create(
+                        [Subtask(task=task, **subtask) for subtask in subtasks])
 
             # Return the newly created task
             return Response(
@@ -190,14 +466,12 @@ class TaskViewSet(viewsets.ModelViewSet):
             obj = data['obj']
             # Live update tags
             if obj == 'tag':
-                task = Task.objects.filter(id=pk).first()
+                task = self.scope.get(self.scope.tasks, id=pk)
 
                 if data['action'] == 'remove':
-                    tag_id = data['tag_id']
-                    tag_obj = Tag.objects.get(id=tag_id)
+                    tag_obj = self.scope.get(self.scope.tags, id=data['tag_id'])
 
                     task.tags.remove(tag_obj)
-                    task.save()
 
                     return Response({'message': f'tag removed'},
                                     status=status.HTTP_200_OK)
@@ -214,7 +488,6 @@ class TaskViewSet(viewsets.ModelViewSet):
 
                     # Add tag
                     task.tags.add(tag_obj)
-                    task.save()
 
                     serialized_tag = TagSerializer(tag_obj).data
 
@@ -227,28 +500,30 @@ class TaskViewSet(viewsets.ModelViewSet):
                                     status=status.HTTP_200_OK)
             # Live update subtasks
             elif obj == 'subtask':
-                task = Task.objects.get(id=pk)
+                # Subtasks of the task, if it is the user's
+                subtasks = self.scope.subtasks.filter(task_id=pk)
 
                 # Create subtask
                 if data['action'] == 'add':
+                    task = self.scope.get(self.scope.tasks, id=pk)
                     subtask = data['subtask']
                     subtask = Subtask.objects.create(task=task, **subtask)
-                    task.save()
 
                     return Response(
                         SubtaskSerializer(subtask).data,
                         status=status.HTTP_201_CREATED)
                 # Remove subtask
                 elif data['action'] == 'remove':
-                    subtask_obj = Subtask.objects.get(id=data['subtask_id'])
+                    subtask_obj = self.scope.get(subtasks, id=data['subtask_id'])
                     subtask_obj.delete()
+                    Change.objects.record(request.user.id, 'task', [subtask_obj.task_id])
 
                     return Response({"message": "subtask removed"},
                                     status=status.HTTP_204_NO_CONTENT)
                 # Update subtask
                 elif data['action'] == 'update':
                     subtask = data['subtask']
-                    subtask_obj = Subtask.objects.get(id=subtask['id'])
+                    subtask_obj = self.scope.get(subtasks, id=subtask['id'])
                     serializer = SubtaskSerializer(subtask_obj, data=subtask)
 
                     if serializer.is_valid():
@@ -257,7 +532,7 @@ class TaskViewSet(viewsets.ModelViewSet):
                     return Response({"message": "updated"},
                                     status=status.HTTP_200_OK)
                 elif data['action'] == 'done':
-                    subtask_obj = Subtask.objects.get(id=data['subtask_id'])
+                    subtask_obj = self.scope.get(subtasks, id=data['subtask_id'])
 
                     subtask_obj.done = not subtask_obj.done
                     subtask_obj.save()
@@ -266,7 +541,7 @@ class TaskViewSet(viewsets.ModelViewSet):
                                     status=status.HTTP_200_OK)
             elif obj == 'task':
                 if data['action'] == 'done':
-                    task = Task.objects.get(id=pk)
+                    task = self.scope.get(self.scope.tasks, id=pk)
 
                     task.done = not task.done
                     task.save()
@@ -274,51 +549,170 @@ class TaskViewSet(viewsets.ModelViewSet):
                     return Response({"done": task.done},
                                     status=status.HTTP_200_OK)
                 if data['action'] == 'increment_gone_through':
-                    task = Task.objects.get(id=pk)
-
-                    task.gone_through += 1
-                    task.save()
+                    gone_through = self.scope.tasks.increment_gone_through(pk)
+                    if gone_through is None:
+                        raise Http404
+                    Change.objects.record(request.user.id, 'task', [pk])
 
                     return Response(
-                        task.gone_through,
+                        gone_through,
                         status=status.HTTP_200_OK)
 
             return Response({'message': 'error'})
 
+    @action(detail=True, methods=['post'])
+    def batch(self, request, pk=None):
+        """
+        Applies an ordered list of live edits, the same obj
+        and action pairs partial_update takes, in one transaction.
+        If one of them fails none of them is kept
+
+        Keyword arguments:
+        operations -- the list of edits, in the request's body
+        """
+        task = self.scope.get(
+            self.scope.tasks.prefetch_related('tags', 'subtasks'), id=pk)
+
+        operations = request.data.get('operations')
+        if not isinstance(operations, list):
+            return Response({'message': 'operations must be a list'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic(), Change.objects.batch():
+            batch = TaskBatch(task, request.user)
+            results = []
+
+            for operation in operations:
+                code, data = batch.apply(operation)
+                results.append({'status': code, 'data': data})
+                if code >= status.HTTP_400_BAD_REQUEST:
+                    transaction.set_rollback(True)
+                    return Response({'results': results},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    def get_bulk_tasks(self, request, project=False):
+        """
+        Returns the validated body of a bulk endpoint and
+        the current user's tasks among its ids
+
+        Keyword arguments:
+        project -- also requires project_id and returns the user's project of it
+        """
+        serializer_class = BulkProjectTasksSerializer if project else BulkTasksSerializer
+        serializer = serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        tasks = self.scope.tasks.filter(id__in=data['ids'])
+
+        if not project:
+            return data, tasks
+        return data, tasks, self.scope.get(self.scope.projects, id=data['project_id'])
+
+    @action(detail=False, methods=['post'])
+    def bulk_done(self, request):
+        """
+        Sets done, true unless done is false, on the tasks of ids
+        in a single UPDATE and answers with the updated ids
+        """
+        data, tasks = self.get_bulk_tasks(request)
+        ids = tasks.set_done(data['done'])
+        Change.objects.record(request.user.id, 'task', ids)
+        return Response({'ids': ids}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def bulk_delete(self, request):
+        """
+        Deletes the tasks of ids and answers with the deleted ids
+        """
+        _, tasks = self.get_bulk_tasks(request)
+        response = Response(status=status.HTTP_200_OK)
+
+        with transaction.atomic():
+            response.data = {'ids': delete_tasks(request.user, tasks, response)}
+
+        return response
+
+    @action(detail=False, methods=['post'])
+    def bulk_add_to_project(self, request):
+        """
+        Adds the tasks of ids to the project of project_id
+        and answers with the ids of the added tasks
+        """
+        _, tasks, project = self.get_bulk_tasks(request, project=True)
+
+        with transaction.atomic(), Change.objects.batch():
+            ids = tasks.add_to_project(project)
+            self.record_project_tasks(project, ids)
+
+        return Response({'ids': ids}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def bulk_remove_from_project(self, request):
+        """
+        Removes the tasks of ids, created outside of it, from
+        the project of project_id and answers with their ids.
+        Tasks created inside a project are left in it
+        """
+        _, tasks, project = self.get_bulk_tasks(request, project=True)
+
+        with transaction.atomic(), Change.objects.batch():
+            ids = tasks.filter(in_project=False).remove_from_project(project)
+            self.record_project_tasks(project, ids)
+
+        return Response({'ids': ids}, status=status.HTTP_200_OK)
+
+    def record_project_tasks(self, project, ids):
+        """
+        Records the tasks of ids, and the project, as changed
+        if the raw SQL changed which tasks the project has
+        """
+        if ids:
+            Change.objects.record(self.request.user.id, 'task', ids)
+            Change.objects.record(self.request.user.id, 'project', [project.id])
+
     def destroy(self, request, pk=None):
         """
         Deletes a task from the current user
         """
-        user = User.objects.get(id=request.user.id)
-        task = Task.objects.get(id=int(pk))
-
-        # If the task being deleted is the same
-        # as the current one
-        # set it to 0
-        if int(pk) == user.current_task_id:
-            user.current_task_id = 0
-            user.save()
+        response = Response(status=status.HTTP_204_NO_CONTENT)
 
-        task.delete()
+        # If the task being deleted is the current
+        # one the current task is set to 0
+        with transaction.atomic():
+            if not delete_tasks(request.user, self.scope.tasks.filter(id=pk), response):
+                raise Http404
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return response
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalGetMixin, UserScopeMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
+    authentication_classes = [ClaimsAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('tags',)
+    write_resources = ('tags',)
     serializer_class = TagSerializer
 
     def get_queryset(self):
         """
         Returns the current user's tags
         """
-        return self.request.user.tags.all()
+        return self.scope.tags
 
+    def list(self, request):
+        """
+        Returns the current user's tags, read through the user cache
+        """
+        return Response(user_tags(self.scope), status=status.HTTP_200_OK)
 
-class ProjectViewSet(viewsets.ModelViewSet):
+
+class ProjectViewSet(ConditionalGetMixin, UserScopeMixin, FieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Project.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('projects', 'tasks', 'tags')
+    write_resources = ('projects', 'tasks')
     serializer_class = ProjectSerializer
     pagination_class = ProjectResultsSetPagination
 
@@ -326,57 +720,64 @@ class ProjectViewSet(viewsets.ModelViewSet):
         """
         Returns the current user's projects
         """
-        return self.request.user.projects.all().order_by('-id')
+        return self.scope.projects.order_by(
+            '-id').with_details(self.get_fieldset())
 
     def get_project(self, pk):
         """
-        Tries to get the project object with the id of pk
+        Tries to get the user's project with the id of pk
         it if fails it raises a HTTP404 error
 
         Keyword arguments:
         pk -- the id of the to be retrieved object
         """
-        try:
-            return Project.objects.get(id=pk)
-        except Project.DoesNotExist:
-            raise Http404
+        return self.scope.get(self.scope.projects, id=pk)
 
     def create(self, request):
         """
-        Create a new Project with tasks
+        Create a new Project with tasks, the tasks, tags
+        and through rows are inserted in bulk
         """
-        project = Project.objects.create(
-            user=request.user, name=request.data['name'])
+        tasks = request.data.get('tasks') or []
+        task_serializers = [TaskSerializer(data=task) for task in tasks]
 
-        tasks = request.data.get('tasks')
+        # Nothing is written unless every task is valid
+        if not all([serializer.is_valid() for serializer in task_serializers]):
+            return Response(
+                {'tasks': [serializer.errors for serializer in task_serializers]},
+                status=status.HTTP_400_BAD_REQUEST)
 
-        if tasks:
-            for task in tasks:
-                task_serializer = TaskSerializer(data=task)
+        with transaction.atomic(), Change.objects.batch():
+            project = Project.objects.create(
+                user=request.user, name=request.data['name'])
 
-                if task_serializer.is_valid():
-                    task_obj = Task.objects.create(
-                        user=request.user, in_project=True, **task_serializer.data)
+            task_objs = Task.objects.bulk_create([
+                Task(user=request.user, in_project=True, **serializer.data)
+                for serializer in task_serializers])
 
-                    tags = task.get('tags')
+            tags = {
+                tag.name: tag for tag in Tag.objects.get_or_create_many(
+                    request.user,
+                    [tag['name'] for task in tasks for tag in task.get('tags') or []])}
 
-                    if tags:
-                        for tag in task['tags']:
-                            tag_obj = Tag.objects.filter(
-                                name=tag['name']).first()
+            Task.tags.through.objects.bulk_create([
+                Task.tags.through(task_id=task_obj.id, tag_id=tags[name].id)
+                for task, task_obj in zip(tasks, task_objs)
+                for name in dict.fromkeys(tag['name'] for tag in task.get('tags') or [])])
 
-                            if not tag_obj:
-                                # Create tag
-                                tag_obj = Tag.objects.create(name=tag['name'], user=request.user)
+            Project.tasks.through.objects.bulk_create([
+                Project.tasks.through(project_id=project.id, task_id=task_obj.id)
+                for task_obj in task_objs])
 
-                            task_obj.tags.add(tag_obj)
+            Change.objects.record(
+                request.user.id, 'task', [task_obj.id for task_obj in task_objs])
 
-                    # Add task to the project
-                    project.tasks.add(task_obj)
-                    project.save()
+        # The through rows were inserted without m2m_changed
+        for tag in tags.values():
+            row_counters['tags'].invalidate(tag.id)
 
         return Response(
-            ProjectSerializer(project).data,
+            ProjectSerializer(Project.objects.with_details().get(id=project.id)).data,
             status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['patch'])
@@ -396,19 +797,20 @@ class ProjectViewSet(viewsets.ModelViewSet):
         task_serializer = TaskSerializer(data=request.data['task'])
 
         if task_serializer.is_valid():
-            task = Task.objects.create(
-                user=request.user, in_project=True, **task_serializer.data)
+            with transaction.atomic(), Change.objects.batch():
+                task = Task.objects.create(
+                    user=request.user, in_project=True, **task_serializer.data)
 
-            tags = request.data['task']['tags']
-            for tag in tags:
-                (the_tag, created) = Tag.objects.get_or_create(
-                    name=tag['name'], user=request.user)
-                task.tags.add(the_tag)
+                tags = request.data['task']['tags']
+                for tag in tags:
+                    (the_tag, created) = Tag.objects.get_or_create(
+                        name=tag['name'], user=request.user)
+                    task.tags.add(the_tag)
 
-            task.save()
+                task.save()
 
-            project.tasks.add(task)
-            project.save()
+                project.tasks.add(task)
+                project.save()
         return Response(
             TaskSerializer(task).data,
             status=status.HTTP_201_CREATED)
@@ -416,7 +818,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['patch'])
     def update_task(self, request, pk=None):
         """Updates the task inside the project"""
-        task = Task.objects.get(id=request.data['subtask']['id'])
+        task = self.scope.get(
+            self.scope.tasks, id=request.data['subtask']['id'], project_tasks=pk)
         serializer = TaskSerializer(task, data=request.data['subtask'])
 
         if serializer.is_valid():
@@ -430,24 +833,26 @@ class ProjectViewSet(viewsets.ModelViewSet):
         Deletes a task inside a project
         or removes it from outside the project
         """
-        task = Task.objects.get(id=request.data['task_id'])
+        task = self.scope.get(
+            self.scope.tasks, id=request.data['task_id'], project_tasks=pk)
 
         # Remove task from project
         if not task.in_project:
-            project = self.get_project(pk)
-            project.tasks.remove(task)
+            task.project_tasks.remove(pk)
 
             return Response("task removed", status=status.HTTP_204_NO_CONTENT)
         # delete task totally
-        task.delete()
+        response = Response("task deleted", status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic(), Change.objects.batch():
+            delete_tasks(request.user, self.scope.tasks.filter(id=task.id), response)
 
-        return Response("task deleted", status=status.HTTP_204_NO_CONTENT)
+        return response
 
     @action(detail=True, methods=['patch'])
     def add_to_project(self, request, pk=None):
         """Adds a task to a project from outside"""
         project = self.get_project(pk)
-        task = Task.objects.get(id=request.data['task_id'])
+        task = self.scope.get(self.scope.tasks, id=request.data['task_id'])
 
         project.tasks.add(task)
         return Response(status=status.HTTP_200_OK)
@@ -455,8 +860,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['patch'])
     def task_done(self, request, pk=None):
         """Toggles a task done status"""
-        project = self.get_project(pk)
-        task = project.tasks.get(id=request.data['task_id'])
+        task = self.scope.get(
+            self.scope.tasks, id=request.data['task_id'], project_tasks=pk)
 
         task.done = not task.done
         task.save()
@@ -468,15 +873,14 @@ class ProjectViewSet(viewsets.ModelViewSet):
         Deletes the project with an id of pk
         """
         project = self.get_project(pk)
+        response = Response({'data': 'project deleted'},
+                            status=status.HTTP_204_NO_CONTENT)
 
-        for task in project.tasks.all():
-            if task.in_project:
-                task.delete()
-
-        project.delete()
+        with transaction.atomic(), Change.objects.batch():
+            delete_tasks(request.user, project.tasks.filter(in_project=True), response)
+            project.delete()
 
-        return Response({'data': 'project deleted'},
-                        status=status.HTTP_204_NO_CONTENT)
+        return response
 
 
 class RegisterJWTView(APIView):
@@ -498,21 +902,28 @@ class RegisterJWTView(APIView):
 
 # The user's login, it inherits from TokenObtainPairView
 class LoginJWTView(TokenObtainPairView):
+  serializer_class = ClaimsTokenObtainPairSerializer
+
   def finalize_response(self, request, response, *args, **kwargs):
     """
     Customize the response of the JWT tokens
 
     So that instead of returning the tokens in the response
     the access token is set as a cookie and the refresh token
-    is stored in the user session.
+    is stored in its own signed cookie or in the user session,
+    see REFRESH_TOKEN_STORAGE.
     """
     # Check for the 'refresh' key from the response
     if response.data.get('refresh'):
       # Set the cookie
       response.set_cookie('access_token', response.data['access'], max_age=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'], httponly=True, samesite='None', secure=True)
 
-      # Set the session token
-      request.session['refresh'] = response.data['refresh']
+      # Store the refresh token
+      store_refresh_token(request, response, response.data['refresh'])
+
+      # The login goes to the database anyway, take the chance
+      # to pick up the tokens revoked by other processes
+      revoked_tokens.sync()
 
       # Add a message to the response
       response.data['message'] = 'Successfully logged in!'
@@ -533,13 +944,12 @@ class LogoutJWTView(APIView):
         response = Response()
 
         # Check if the user is logged in
-        if request.COOKIES.get('sessionid'):
-            # Delete the token and the session
+        if has_refresh_token(request):
+            # Revoke and delete the access and the refresh tokens,
+            # so a copy of them can no longer be used
+            revoke_tokens(request)
             response.delete_cookie('access_token')
-            response.delete_cookie('sessionid')
-
-            # Delete the refresh token from the session
-            request.session = {}
+            clear_refresh_token(request, response)
 
             response.data = { 'message': 'You are logged out' }
             response.status_code = 200
@@ -550,21 +960,22 @@ class LogoutJWTView(APIView):
         return response
 
 
-class CurrentUserView(APIView):
+class CurrentUserView(ConditionalGetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('me',)
 
     def get(self, request):
         """
-        Returns the current user's info
+        Returns the current user's info, read through the user cache
         """
-        return Response(
-            UserSerializer(
-                request.user).data,
-            status=status.HTTP_200_OK)
+        return Response(user_info(request.user), status=status.HTTP_200_OK)
 
 
-class CurrentTaskView(APIView):
+class CurrentTaskView(ConditionalGetMixin, UserScopeMixin, APIView):
+    authentication_classes = [ClaimsAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('me',)
+    write_resources = ('me',)
 
     def get(self, request):
         """
@@ -575,34 +986,36 @@ class CurrentTaskView(APIView):
 
     def put(self, request):
         """
-        Changes the current task id received in the request
+        Changes the current task id received in the request,
+        0 clears it
         """
-        user = User.objects.get(id=request.user.id)
-        user.current_task_id = request.data['id']
-        user.save()
+        user_state = UserState(request.user)
+        if not user_state.set_current_task(request.data['id']):
+            raise Http404
 
-        return Response({'id': user.current_task_id},
-                        status=status.HTTP_200_OK)
+        response = Response({'id': user_state.user.current_task_id},
+                            status=status.HTTP_200_OK)
+        user_state.refresh_access_cookie(response)
+        return response
 
 
-class CurrentModeView(APIView):
+class CurrentModeView(ConditionalGetMixin, APIView):
+    authentication_classes = [ClaimsAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('me', 'modes')
+    write_resources = ('me',)
 
     def get_mode(self, id):
         """
-        Tries to get the mode object with the id of id
-        it if fails it raises a HTTP404 error
+        Returns the user's mode with the id of id, the
+        built-in Default mode for 0 or a mode that is gone
 
         Keyword arguments:
         id -- the id of the to be retrieved object
         """
-        try:
-            mode = Mode.objects.get(id=id)
-            return Response(
-                ModesSerializer(mode).data,
-                status=status.HTTP_200_OK)
-        except Mode.DoesNotExist:
-            raise Http404
+        return Response(
+            current_mode(self.request.user.id, id),
+            status=status.HTTP_200_OK)
 
     def get(self, request):
         return self.get_mode(request.user.current_mode_id)
@@ -610,33 +1023,127 @@ class CurrentModeView(APIView):
     # Change the current mode
     def post(self, request):
         mode_id = request.data['mode_id']
-        user = User.objects.get(id=request.user.id)
-
-        user.current_mode_id = mode_id
-
-        user.save()
+        user_state = UserState(request.user)
+        if not user_state.set_current_mode(mode_id):
+            raise Http404
 
-        return self.get_mode(mode_id)
+        response = self.get_mode(mode_id)
+        user_state.refresh_access_cookie(response)
+        return response
 
 
-class TagInfo(APIView):
+class TagInfo(ConditionalGetMixin, UserScopeMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('tasks', 'tags', 'projects')
 
     def get(self, request, name=None):
         """
         Tries to get the tag with the name of name
-        if it succeeds it returns the tasks inside the tag
+        if it succeeds it returns a page of the tasks inside the tag
         if it fails it raise a HTTP 404 error
 
         Keyword arguments:
         name -- the name of the tag
         """
+        fieldset = Fieldset.from_request(request)
+        tag = self.scope.get(self.scope.tags, name=name)
+
+        tasks = tag.tasks.with_details(fieldset)
+
+        done = request.query_params.get('done')
+        if done is not None:
+            tasks = tasks.filter(done=done in ('true', '1'))
+
+        paginator = TagTasksPagination(tag)
+        page = paginator.paginate_queryset(tasks, request, view=self)
+        return paginator.get_paginated_response(
+            TaskSerializer(page, many=True, fieldset=fieldset).data)
+
+
+class ChangesView(APIView):
+    authentication_classes = [ClaimsAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        """
+        Returns the changes of the current user's rows since
+        the cursor of ?since=, each row once with its data or
+        as a tombstone. Without ?since= only the cursor to
+        start from is returned, it has to be taken before
+        loading everything else
+
+        Keyword arguments:
+        since -- the cursor returned by the previous call
+        limit -- the maximum number of log entries read
+        """
+        feed = ChangeFeed(request.user)
+        since = request.query_params.get('since')
+        if not since:
+            return Response({'cursor': feed.head(), 'more': False, 'changes': []},
+                            status=status.HTTP_200_OK)
+
+        options = change_feed_settings()
         try:
-            tag = Tag.objects.get(name=name, user=self.request.user)
-            return Response(
-                TaskSerializer(
-                    tag.tasks,
-                    many=True).data,
-                status=status.HTTP_200_OK)
-        except Tag.DoesNotExist:
-            raise Http404
+            limit = min(int(request.query_params.get('limit', options['PAGE_SIZE'])),
+                        options['MAX_PAGE_SIZE'])
+        except ValueError:
+            limit = options['PAGE_SIZE']
+
+        return Response(feed.read(since, max(limit, 1)), status=status.HTTP_200_OK)
+
+
+class BootstrapView(ConditionalGetMixin, UserScopeMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    etag_resources = ('me', 'modes', 'tags', 'tasks', 'projects')
+
+    def first_page(self, queryset, serializer, pagination, route):
+        """
+        Returns the first page of route, as its list endpoint
+        answers it, with the cached count of its rows
+        """
+        results = list(queryset[:pagination.page_size])
+        count = row_counters[pagination.counter].count(self.request.user.id, queryset)
+
+        next_link = None
+        if count > pagination.page_size:
+            next_link = self.request.build_absolute_uri(f'{reverse(route)}?page=2')
+
+        return {
+            'count': count,
+            'next': next_link,
+            'previous': None,
+            'results': serializer(results, many=True).data,
+        }
+
+    def get(self, request):
+        """
+        Returns everything the dashboard loads first in one
+        response: the user, its current task and mode, its
+        modes and tags, and the first pages of its tasks and
+        projects. The number of queries does not depend on
+        the number of rows, and the cached parts run none
+        """
+        tasks = self.first_page(
+            self.scope.tasks.filter(in_project=False).order_by('-id').with_details(),
+            TaskSerializer, TaskResultsSetPagination, 'task-list')
+        projects = self.first_page(
+            self.scope.projects.order_by('-id').with_details(),
+            ProjectSerializer, ProjectResultsSetPagination, 'project-list')
+
+        # The current task is most often on the first page
+        current_task_id = request.user.current_task_id
+        current_task = next(
+            (task for task in tasks['results'] if task['id'] == current_task_id), None)
+        if current_task is None and current_task_id:
+            task = self.scope.tasks.with_details().filter(id=current_task_id).first()
+            current_task = task and TaskSerializer(task).data
+
+        return Response({
+            'me': user_info(request.user),
+            'current_task': current_task,
+            'current_mode': current_mode(request.user.id, request.user.current_mode_id),
+            'modes': user_modes(request.user.id),
+            'tags': user_tags(self.scope),
+            'tasks': tasks,
+            'projects': projects,
+        }, status=status.HTTP_200_OK)
@@ -114,6 +114,49 @@ SIMPLE_JWT = {
     'AUTH_COOKIE_SAMESITE': 'None',      # Whether to set the flag restricting cookie leaks on cross-site requests. This can be 'Lax', 'Strict', or None to disable the flag
 }
 
+# In-process cache of verified access tokens and their users
+AUTH_TOKEN_CACHE = {
+    'ENABLED': True,
+    'MAX_SIZE': 1024,                   # Tokens kept per process, least recently used ones are evicted
+    'TTL': 300,                         # Seconds a token is kept, it never outlives the token's exp
+}
+
+# Where the refresh token is kept between requests
+REFRESH_TOKEN_STORAGE = {
+    'MODE': 'cookie',                   # 'cookie' for a signed cookie, or 'session' to keep it in the user's session
+    'COOKIE': 'refresh_token',          # Cookie name
+    'COOKIE_PATH': '/api/',             # Only sent to the API, the session is left to the admin
+    'COOKIE_SALT': 'api.refresh_token', # Salt of the cookie's signature
+}
+
+# Tokens revoked at logout, checked through an in-process Bloom filter
+REVOKED_TOKENS = {
+    'BLOOM_BITS': 2 ** 20,              # Size of the filter, 128KB
+    'BLOOM_HASHES': 7,                  # Hash functions per token
+    'SYNC_INTERVAL': 5,                 # Seconds a token revoked by another worker may still be accepted, None only for a single process
+}
+
+# Per user row counts returned by the cursor pagination's ?count=true
+ROW_COUNT_CACHE = {
+    'MAX_SIZE': 4096,                   # Users kept per process, least recently used ones are evicted
+    'TTL': 300,                         # Seconds a count is kept, bounds the staleness across workers
+}
+
+# Per user tags, modes and info, read through on every navigation
+USER_CACHE = {
+    'BACKEND': 'local',                 # 'local' to keep them per process, or 'shared' to use the Django cache below, whose versions let 304s skip the views
+    'CACHE': 'default',                 # Alias of the Django cache used by the shared backend, has to be seen by every worker (Redis, Memcached), LocMemCache is refused
+    'MAX_SIZE': 4096,                   # Entries kept per process by the local backend, least recently used ones are evicted
+    'TTL': 300,                         # Seconds an entry is kept, bounds the staleness across workers of the local backend
+}
+
+# The per user change log read through /api/changes/
+CHANGE_FEED = {
+    'PAGE_SIZE': 100,                   # Log entries read per call, unless ?limit= asks for fewer
+    'MAX_PAGE_SIZE': 500,               # Highest ?limit= accepted
+    'RETENTION': 7 * 24 * 3600,         # Seconds tombstones are kept by compact_changes, older cursors get a 410
+}
+
 ROOT_URLCONF = 'main.urls'
 
 TEMPLATES = [